@@ -10,9 +10,12 @@ import click
 import time
 import urllib.parse
 import glob
+import functools
 from datetime import datetime
 
-from facts.core import workflow
+from facts.core import workflow, relevance, BoringDocument, key_in_shard
+from facts import common
+import facts.fetch
 
 logger = logging.getLogger()
 
@@ -25,15 +28,102 @@ def cli(debug=False):
         logger.setLevel(logging.DEBUG)
 
 
-class BoringPaper(Exception):
+class BoringPaper(BoringDocument):
     "boring"
 
 
+paper_store_fn = "arxiv-papers.json"
+
+# only what the workflows use is kept of the feed entries
+paper_fields = 'id', 'title', 'summary', 'updated'
+
+
+def paper_key(entry) -> str:
+    # arXiv id with version, as in the identity
+    return entry['id'].split("/")[-1]
+
+
+def trim_entry(entry) -> PaperEntry:
+    return PaperEntry({k: entry[k] for k in paper_fields if k in entry})
+
+
+def load_papers(fn=paper_store_fn) -> typing.Dict[str, PaperEntry]:
+    if os.path.exists(fn):
+        return json.load(open(fn))
+
+    return {}
+
+
+@functools.lru_cache(maxsize=1)
+def loaded_papers(fn, size, mtime_ns) -> typing.Dict[str, PaperEntry]:
+    # the store as of this size and modification time, parsed once for all shards
+    return load_papers(fn)
+
+
+def merge_papers(entries, fn=paper_store_fn) -> int:
+    # the store is rewritten only if there are new papers or versions, so that it is clear when there is nothing new to learn
+    papers = load_papers(fn)
+    n_new = 0
+
+    for entry in entries:
+        e = trim_entry(entry)
+        if papers.get(paper_key(e)) != e:
+            papers[paper_key(e)] = e
+            n_new += 1
+
+    if n_new > 0:
+        with open(fn + ".tmp", "w") as f:
+            json.dump(papers, f)
+        os.replace(fn + ".tmp", fn)
+
+    logger.info(f"merged {n_new} new papers, {len(papers)} in total")
+
+    return n_new
+
+
+arxiv_api_url = "http://export.arxiv.org/api/query"
+
+
+def harvest(search_query, sortBy, known, max_results, page_size=100) -> typing.List[dict]:
+    # pages back in time until reaching papers already known, or max_results
+    entries = [] # type: typing.List[dict]
+
+    for start in range(0, max_results, page_size):
+        params = dict(
+            search_query=search_query,
+            sortBy=sortBy,
+            sortOrder='descending',
+            start=start,
+            max_results=min(page_size, max_results - start),
+        )
+
+        logger.info(f"params: {params}")
+
+        r = facts.fetch.get(arxiv_api_url + '?' + urllib.parse.urlencode(params, doseq=True))
+        r.raise_for_status()
+
+        page = feedparser.parse(r.text)['entries']
+
+        for entry in page:
+            logger.debug(f'fetched {entry["id"].split("/")[-1]} ({entry["updated"]}): {entry["title"]}')
+
+        entries.extend(page)
+
+        n_known = sum(paper_key(entry) in known for entry in page)
+
+        if n_known > 0 or len(page) < params['max_results']:
+            logger.info(f"{search_query} by {sortBy}: {len(entries) - n_known} new entries, stopping at {start + len(page)} ({n_known} known in the last page)")
+            break
+
+    return entries
+
+
 @cli.command()
 @click.option("-s", "--search-string", default="")
 @click.option("-c", "--category", default="astro-ph.*")
-@click.option("-n", "--max-results", default=10)
-def fetch(search_string, max_results, category):
+@click.option("-n", "--max-results", default=10, help="at most this many entries for each category and order, if they are all new")
+@click.option("--page-size", default=100)
+def fetch(search_string, max_results, category, page_size):
     cats=[
             "astro-ph",
             "astro-ph.GA",
@@ -44,6 +134,10 @@ def fetch(search_string, max_results, category):
             "astro-ph.SR",
         ]
 
+    known = set(load_papers())
+
+    queries = []
+
     for cat in cats:
         if not re.search(category, cat):
             continue
@@ -54,31 +148,36 @@ def fetch(search_string, max_results, category):
         if search_string != "":
             s = f"{s} AND {search_string}"
 
-        def getBy(sortBy):
-            params = dict(
-                search_query=f'{s}',
-                sortBy=sortBy,
-                sortOrder='descending',
-                max_results=max_results
-            )
+        queries += [(s, "lastUpdatedDate"), (s, "submittedDate")]
 
-            logger.info(f"params: {params}")
+    # requests are issued concurrently, and spaced by facts.fetch according to the arXiv API rate limit
+    entries = []
+    failures = []
 
-            r = requests.get('http://export.arxiv.org/api/query?'+ urllib.parse.urlencode(params, doseq=True))
+    for (s, sortBy), r, e in facts.fetch.prefetch(lambda q: harvest(q[0], q[1], known, max_results, page_size), queries, nthreads=4):
+        if e is not None:
+            logger.error(f"unable to harvest {s} by {sortBy}: {repr(e)}")
+            failures.append(e)
+            continue
 
-            feed = feedparser.parse(r.text)
-            json.dump(feed, open(f"papers-recent-{cat}-{sortBy}.json", "w"))
+        entries.extend(r)
 
-            for entry in feed['entries']:
-                logger.debug(f'fetched {entry["id"].split("/")[-1]} ({entry["updated"]}): {entry["title"]}')
+    # what was harvested is kept, so that the next run does not fetch it again, before the failure is reported
+    merge_papers(entries)
 
-        getBy("lastUpdatedDate")
-        getBy("submittedDate")
+    if len(failures) > 0:
+        raise failures[0]
 
 @cli.command()
 def fetch_recent():
     r = requests.get('http://arxiv.org/rss/astro-ph')
-    json.dump(feedparser.parse(r.text), open("papers-recent.json", "w"))
+    merge_papers(feedparser.parse(r.text)['entries'])
+
+
+@cli.command("merge-dumps")
+def merge_dumps():
+    # papers-*.json feed dumps of earlier versions
+    merge_papers(e for fn in sorted(glob.glob("papers-*json")) for e in json.load(open(fn))['entries'])
 
 @cli.command()
 def fetch_tar():
@@ -103,14 +202,19 @@ def basic_time_meta(entry: PaperEntry):  # ->
 
 
 @workflow
+@relevance
 def mentions_keyword(entry: PaperEntry):  # ->
     d = {} # type: typing.Dict[str, typing.Any]
 
-    for keyword in "INTEGRAL", "FRB", "GRB", "GW170817", "GW190425", "magnetar", "SGR":
+    keywords = "INTEGRAL", "FRB", "GRB", "GW170817", "GW190425", "magnetar", "SGR"
+
+    counts = {field: common.count_keywords(entry[field], keywords) for field in ('title', 'summary')}
+
+    for keyword in keywords:
         k = keyword.lower()
 
         for field in 'title', 'summary':
-            n = len(re.findall(keyword, entry[field]))
+            n = counts[field][keyword]
             if n>0:
                 d['mentions_'+k] = field
             if n>1:
@@ -120,12 +224,14 @@ def mentions_keyword(entry: PaperEntry):  # ->
     return d
 
 @workflow
-def list_entries() -> typing.List[PaperEntry]:
-    es = [] # type: typing.List[PaperEntry]
-    for fn in glob.glob("papers-*json"):
-        es += json.load(open(fn))['entries']
-
-    return es
+def list_entries(shard=None) -> typing.List[PaperEntry]:
+    if shard is None or not os.path.exists(paper_store_fn):
+        papers = load_papers()
+    else:
+        st = os.stat(paper_store_fn)
+        papers = loaded_papers(paper_store_fn, st.st_size, st.st_mtime_ns)
+
+    return [e for e in papers.values() if key_in_shard(f"arxiv:{e['id'].split('/')[-1]}", shard)]
 
 @workflow
 def identity(entry: PaperEntry) -> str:
@@ -10,9 +10,10 @@ import click
 import time
 import urllib.parse
 import glob
+import functools
 from datetime import datetime
 
-from facts.core import workflow
+from facts.core import workflow, relevance, BoringDocument, DocumentHandle, key_in_shard
 from facts import common
 
 logger = logging.getLogger()
@@ -25,9 +26,102 @@ def cli(debug=False):
     if debug:
         logger.setLevel(logging.DEBUG)
 
-class BoringAtel(Exception):
+class BoringAtel(BoringDocument):
     "boring"
 
+
+atel_store_fn = "atels.jsonl"
+
+
+class ATelStore:
+    # parsed ATels appended as JSON lines, with an index of the latest record of each ATel,
+    # and a manifest of the cached emails already parsed
+
+    def __init__(self, fn):
+        self.fn = fn
+
+        if os.path.exists(fn + ".index"):
+            self.index = {int(k): v for k, v in json.load(open(fn + ".index")).items()} # type: typing.Dict[int, typing.List[int]]
+            self.manifest = json.load(open(fn + ".manifest")) # type: typing.Dict[str, list]
+        else:
+            self.index = {}
+            self.manifest = {}
+
+    def __contains__(self, atelid):
+        return int(atelid) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, atelid) -> ATelEntry:
+        offset, size = self.index[int(atelid)]
+
+        with open(self.fn, "rb") as f:
+            f.seek(offset)
+            return ATelEntry(json.loads(f.read(size)))
+
+    def __iter__(self) -> typing.Generator[ATelEntry, None, None]:
+        # records are read in file order, skipping those superseded by a later version of the same ATel
+        if not os.path.exists(self.fn):
+            return
+
+        current = set(offset for offset, size in self.index.values())
+
+        with open(self.fn, "rb") as f:
+            offset = 0
+            for line in f:
+                if offset in current:
+                    yield ATelEntry(json.loads(line))
+                offset += len(line)
+
+    def ingest(self, fns) -> int:
+        # only emails which are new or changed since they were parsed are parsed again
+        n_new = 0
+
+        with open(self.fn, "ab") as f:
+            for fn in fns:
+                st = os.stat(fn)
+                key = os.path.basename(fn)
+
+                if self.manifest.get(key, [None, None])[:2] == [st.st_size, st.st_mtime_ns]:
+                    continue
+
+                try:
+                    with open(fn, "rb") as email_f:
+                        entry = parse_atel_email(email_f)
+                except Exception as e:
+                    logger.warning("unable to parse ATel email %s: %s", fn, repr(e))
+                    self.manifest[key] = [st.st_size, st.st_mtime_ns, None]
+                    continue
+
+                line = (json.dumps(entry) + "\n").encode()
+                self.index[int(entry['atelid'])] = [f.tell(), len(line)]
+                self.manifest[key] = [st.st_size, st.st_mtime_ns, entry['atelid']]
+                f.write(line)
+                n_new += 1
+
+        if n_new > 0 or not os.path.exists(self.fn + ".index"):
+            self.save()
+
+        logger.info("ingested %d new ATels, %d in total", n_new, len(self.index))
+
+        return n_new
+
+    def save(self):
+        for suffix, d in (".index", self.index), (".manifest", self.manifest):
+            with open(self.fn + suffix + ".tmp", "w") as f:
+                json.dump(d, f)
+            os.replace(self.fn + suffix + ".tmp", self.fn + suffix)
+
+
+@functools.lru_cache(maxsize=None)
+def atel_store(fn=atel_store_fn) -> ATelStore:
+    return ATelStore(fn)
+
+
+def get_atel(atelid) -> ATelEntry:
+    return atel_store().get(atelid)
+
 @workflow
 def atel_date(entry: ATelEntry) -> dict:  # date
     t = datetime.strptime(
@@ -107,18 +201,9 @@ def parse_atel_cache_id(atelid):
 @cli.command('fetch')
 #TODO: control all vs recent
 def fetch():    
-    es = []
-
-    for fn in glob.glob(atel_cache_fn("*")):
-        # entry = dict(zip(['atelid', 'url', 'title', 'authors', 'date'], l))
-        # logging.debug("%s", entry)
-        # es.append(entry)
-        with open(fn, "rb") as f:            
-            es.append(parse_atel_email(f))
-            
-        # break
-
-    json.dump(es, open('atels.json','w'))
+    atel_store.cache_clear()
+    atel_store().ingest(sorted(glob.glob(atel_cache_fn("*"))))
+    atel_store.cache_clear()
 
 @cli.command('fetch-web')
 #TODO: control all vs recent
@@ -146,11 +231,13 @@ def fetch_web():
     json.dump(es, open('atels.json','w'))
 
 @workflow
+@relevance
 def mentions_keyword(entry: ATelEntry):  # ->
     return common.mentions_keyword(entry['title'], entry['body'])
 
 
 @workflow
+@relevance
 def mentions_named(entry: ATelEntry):  # ->
     return common.mentions_grblike(entry['title'], entry['body'])
 
@@ -170,11 +257,32 @@ def basic_meta(entry: ATelEntry):  # ->$
         )
 
 
-@workflow
-def list_entries() -> typing.List[ATelEntry]:
-    es = json.load(open('atels.json'))
+def atel_number(atelid) -> int:
+    return int(str(atelid).split('/')[-1])
 
-    return es
+
+def atel_shard_key(atelid) -> str:
+    return f"atel:{atel_number(atelid)}"
+
+
+@workflow
+def list_entries(shard=None) -> typing.Generator[ATelEntry, None, None]:
+    # ATels parsed from the cached emails, in the store, and those listed by fetch-web and parse-html, in atels.json,
+    # which are only read if they are not in the store.
+    # with a shard, only ATels of the shard are read from the store, in the worker
+    store = atel_store() if os.path.exists(atel_store_fn) else ATelStore(atel_store_fn)
+
+    if shard is None:
+        yield from store
+    else:
+        for atelid in sorted(store.index):
+            if key_in_shard(atel_shard_key(atelid), shard):
+                yield DocumentHandle("facts.atel:get_atel", atelid)
+
+    if os.path.exists('atels.json'):
+        for entry in json.load(open('atels.json')):
+            if atel_number(entry['atelid']) not in store and key_in_shard(atel_shard_key(entry['atelid']), shard):
+                yield entry
 
 @workflow
 def identity(entry: ATelEntry) -> str:
@@ -0,0 +1,304 @@
+import logging
+import typing
+import json
+import os
+import sys
+import random
+import contextlib
+import tempfile
+import time
+import click
+
+import facts.core
+import facts.gcn
+import facts.atel
+import facts.arxiv
+
+logger = logging.getLogger()
+
+
+@click.group()
+@click.option("--debug", "-d", default=False, is_flag=True)
+def cli(debug=False):
+    if debug:
+        logger.setLevel(logging.DEBUG)
+
+
+# circulars of the kinds the workflows look for, and plain prose; without URLs, so that nothing is fetched
+gcn_templates = [
+"""TITLE:   GCN CIRCULAR
+NUMBER:  {gcnid}
+SUBJECT: GRB {grb}: Fermi GBM Final Real-time Localization
+DATE:    {yy}/{mm:02d}/{dd:02d} {hh:02d}:{mi:02d}:{ss:02d} GMT
+FROM:    Fermi GBM Team at MSFC/Fermi-GBM  <do_not_reply@GBM.team>
+
+The Fermi GBM team reports the detection of a LONG GRB
+
+At {hh:02d}:{mi:02d}:{ss:02d}.{ms:02d} UT on {dd:02d} {month} 20{yy}, the Fermi Gamma-Ray Burst Monitor (GBM) triggered and located GRB {grb} (trigger {trigger} / {trigger_frac}).
+The on-ground calculated location, using the Fermi GBM trigger data, is RA = {ra:.1f}, Dec = {dec:.1f} (J2000 degrees, equinox 2000),
+with a statistical uncertainty of {err:.1f} degrees.
+
+The angle from the Fermi LAT boresight is 63 degrees.
+""",
+"""TITLE:   GCN CIRCULAR
+NUMBER:  {gcnid}
+SUBJECT: LIGO/Virgo S{yy}{mm:02d}{dd:02d}{suffix}: Upper limits from INTEGRAL SPI-ACS and IBIS/Veto observations, counterpart search
+DATE:    {yy}/{mm:02d}/{dd:02d} {hh:02d}:{mi:02d}:{ss:02d} GMT
+FROM:    A. Author at Somewhere  <a.author@example.org>
+
+A. Author (Inst), B. Author (Inst)
+and C. Author report on behalf of the INTEGRAL team:
+
+Using INTEGRAL SPI-ACS and IBIS/Veto data, we have performed a search for a prompt gamma-ray counterpart of
+the compact binary merger candidate S{yy}{mm:02d}{dd:02d}{suffix} at 20{yy}-{mm:02d}-{dd:02d} {hh:02d}:{mi:02d}:{ss:02d}.{ms:03d} UTC, hereafter T0.
+
+We find no significant counterpart and estimate a 3-sigma upper limit on the 75-2000 keV fluence of {ul:.1e} erg/cm2
+for a burst lasting less than 1 s with a characteristic short GRB spectrum.
+""",
+"""TITLE:   GCN CIRCULAR
+NUMBER:  {gcnid}
+SUBJECT: IceCube-{yy}{mm:02d}{dd:02d}A - IceCube observation of a high-energy neutrino candidate track-like event
+DATE:    {yy}/{mm:02d}/{dd:02d} {hh:02d}:{mi:02d}:{ss:02d} GMT
+FROM:    Someone at IceCube  <roc@icecube.wisc.edu>
+
+The IceCube Collaboration (http_icecube_wisc_edu) reports:
+
+On 20{yy}/{mm:02d}/{dd:02d} at {hh:02d}:{mi:02d}:{ss:02d}.{ms:02d} UT IceCube detected a track-like event with a high probability
+of being of astrophysical origin. The event was selected by the ICECUBE_Astrotrack_Gold alert stream.
+
+RA: {ra:.2f} (+1.50 -1.20 deg 90% PSF containment) J2000
+Dec: {dec:.2f} (+0.90 -0.80 deg 90% PSF containment) J2000
+""",
+"""TITLE:   GCN CIRCULAR
+NUMBER:  {gcnid}
+SUBJECT: GRB {grb}: INTEGRAL SPI-ACS detection
+DATE:    {yy}/{mm:02d}/{dd:02d} {hh:02d}:{mi:02d}:{ss:02d} GMT
+FROM:    A. Author at Somewhere  <a.author@example.org>
+
+A. Author (Inst), B. Author (Inst)
+report on behalf of the INTEGRAL team:
+
+GRB {grb} was detected by INTEGRAL SPI-ACS at {hh:02d}:{mi:02d}:{ss:02d} UT, with a duration of about 20 s,
+see also GCN Circ. {cited} and GCN {cited2}. The afterglow was clearly detected by Swift/XRT.
+We find a limiting fluence of {ul:.1e} erg/cm2 for 1 s.
+""",
+"""TITLE:   GCN CIRCULAR
+NUMBER:  {gcnid}
+SUBJECT: GRB {grb}: Swift detection of a burst
+DATE:    {yy}/{mm:02d}/{dd:02d} {hh:02d}:{mi:02d}:{ss:02d} GMT
+FROM:    A. Author at Somewhere  <a.author@example.org>
+
+A. Author (Inst), B. Author (Inst)
+report on behalf of the Neil Gehrels Swift Observatory Team:
+
+At {hh:02d}:{mi:02d}:{ss:02d} UT, the Swift Burst Alert Telescope (BAT) triggered and located GRB {grb} (trigger={trigger}).
+Swift slewed immediately to the burst. The BAT on-board calculated location is RA, Dec {ra:.3f}, {dec:.3f}.
+""",
+"""TITLE:   GCN CIRCULAR
+NUMBER:  {gcnid}
+SUBJECT: ZTF{yy}aa{suffix}: optical follow-up observations
+DATE:    {yy}/{mm:02d}/{dd:02d} {hh:02d}:{mi:02d}:{ss:02d} GMT
+FROM:    A. Author at Somewhere  <a.author@example.org>
+
+A. Author (Inst), B. Author (Inst)
+report on behalf of a larger collaboration:
+
+""" + "We observed the field with the 2-m telescope in the r and g bands, and found nothing remarkable in the images. " * 20 + """
+Further observations are planned.
+""",
+]
+
+months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def corpus_gcns(n, seed=0) -> typing.List[facts.gcn.GCNText]:
+    rng = random.Random(seed)
+    gcns = []
+
+    for i in range(n):
+        mm, dd = rng.randint(1, 12), rng.randint(1, 28)
+        yy = rng.randint(17, 22)
+        grb = f"{yy}{mm:02d}{dd:02d}{rng.choice('ABC')}"
+
+        gcns.append(facts.gcn.GCNText(gcn_templates[i % len(gcn_templates)].format(
+            gcnid=20000 + i, grb=grb, yy=yy, mm=mm, dd=dd, month=months[mm - 1],
+            hh=rng.randint(0, 23), mi=rng.randint(0, 59), ss=rng.randint(0, 59), ms=rng.randint(0, 99),
+            trigger=rng.randint(500000000, 700000000), trigger_frac=f"{yy}{mm:02d}{dd:02d}{rng.randint(0, 999):03d}",
+            ra=rng.uniform(0, 360), dec=rng.uniform(-90, 90), err=rng.uniform(1, 10), ul=rng.uniform(1e-7, 1e-6),
+            suffix=rng.choice(["ar", "bp", "ae"]), cited=20000 + rng.randint(0, i + 1), cited2=20000 + rng.randint(0, i + 1),
+        )))
+
+    return gcns
+
+
+def corpus_atels(n, seed=0) -> typing.List[facts.atel.ATelEntry]:
+    rng = random.Random(seed)
+    atels = []
+
+    for i in range(n):
+        atelid = str(14000 + i)
+        body = rng.choice([
+            "We report INTEGRAL observations of the magnetar SGR 1935+2154 following FRB 200428, see ATel #13681 and GCN 27625. ",
+            "Optical spectroscopy of the transient AT2021abc shows broad Balmer lines, consistent with a type II supernova. ",
+            "The blazar 4C +21.35 is in a bright gamma-ray state, as detected by Fermi-LAT, following GRB 210101A. ",
+        ]) * rng.randint(1, 10)
+
+        atels.append(facts.atel.ATelEntry(dict(
+            atelid=atelid,
+            url=f"https://www.astronomerstelegram.org/?read={atelid}",
+            title=rng.choice(["INTEGRAL observations of SGR 1935+2154", "Spectroscopic classification of AT2021abc", "Fermi-LAT detection of 4C +21.35"]),
+            authors="A. Author, B. Author",
+            date=f"{rng.randint(1, 28)} {rng.choice(months)} 2021; {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d} UT",
+            tags="Gamma Ray, >GeV, Magnetar, FRB",
+            body=body,
+        )))
+
+    return atels
+
+
+def corpus_papers(n, seed=0) -> typing.List[facts.arxiv.PaperEntry]:
+    rng = random.Random(seed)
+    papers = []
+
+    for i in range(n):
+        papers.append(facts.arxiv.PaperEntry(dict(
+            id=f"http://arxiv.org/abs/21{rng.randint(1, 12):02d}.{i:05d}v{rng.randint(1, 3)}",
+            title=rng.choice(["INTEGRAL view of GRB 221009A", "A population study of FRB hosts", "Magnetar giant flares and SGR bursts"]),
+            summary=rng.choice([
+                "We analyse INTEGRAL and Fermi observations of GRB 221009A, the brightest GRB, and compare with GW170817. ",
+                "Fast radio bursts (FRB) are bright millisecond radio transients, possibly produced by magnetars. ",
+                "We discuss the stellar populations of nearby galaxies with deep optical imaging. ",
+            ]) * rng.randint(1, 5),
+            updated=f"2021-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00Z",
+        )))
+
+    return papers
+
+
+def corpus(n_gcn=600, n_atel=300, n_arxiv=300, seed=0) -> typing.Dict[str, list]:
+    return {
+        'GCNText': corpus_gcns(n_gcn, seed),
+        'ATelEntry': corpus_atels(n_atel, seed),
+        'PaperEntry': corpus_papers(n_arxiv, seed),
+    }
+
+
+def best_time_s(f, repeat, min_s=0.5) -> typing.Tuple[float, typing.Any]:
+    # time of one call in the least disturbed of several runs, each calling f for at least min_s
+    best_s, r = float('inf'), None
+
+    for i in range(repeat):
+        n = 0
+        t0 = time.perf_counter()
+
+        while n == 0 or time.perf_counter() - t0 < min_s:
+            r = f()
+            n += 1
+
+        best_s = min(best_s, (time.perf_counter() - t0) / n)
+
+    return best_s, r
+
+
+def run_benchmarks(docs: typing.Dict[str, list], repeat=3, min_s=0.5) -> typing.Dict[str, float]:
+    # throughputs, higher is better; per-workflow ones are calls per second of the workflow alone
+    metrics = {}
+    input_types = {'GCNText': facts.gcn.GCNText, 'ATelEntry': facts.atel.ATelEntry, 'PaperEntry': facts.arxiv.PaperEntry}
+
+    fact_cache, facts.core.fact_cache = facts.core.fact_cache, None
+    facts.core.workflow_stats.pop()
+
+    try:
+        all_triples = []
+
+        for type_name, values in docs.items():
+            entries = [dict(arg=v, arg_type=input_types[type_name]) for v in values]
+
+            # some workflows print what they find
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                duration_s, results = best_time_s(lambda: [facts.core.workflows_for_input(e, output='triples') for e in entries], repeat, min_s)
+            metrics[f"pipeline.{type_name}.docs_per_s"] = len(entries) / duration_s
+
+            for c_id, triples in results:
+                all_triples.extend(triples)
+
+        for name, r in facts.core.workflow_stats.pop().items():
+            if r['total_s'] > 0:
+                metrics[f"workflow.{name}.calls_per_s"] = r['calls'] / r['total_s']
+
+        n = len(all_triples)
+
+        duration_s, G = best_time_s(lambda: facts.core.facts_graph(all_triples), repeat, min_s)
+        metrics["graph.build.facts_per_s"] = n / duration_s
+
+        duration_s, _ = best_time_s(lambda: facts.core.serialize_graph(G), repeat, min_s)
+        metrics["graph.serialize_n3.facts_per_s"] = n / duration_s
+
+        with tempfile.TemporaryDirectory() as tmp:
+            duration_s, _ = best_time_s(lambda: facts.core.write_sorted_ntriples([("all", all_triples)], os.path.join(tmp, "k.nt")), repeat, min_s)
+            metrics["graph.sorted_ntriples.facts_per_s"] = n / duration_s
+    finally:
+        facts.core.fact_cache = fact_cache
+
+    return metrics
+
+
+def compare(metrics, baseline, threshold=0.25, workflow_threshold=0.5) -> typing.List[str]:
+    # throughput falling below the baseline by more than the threshold is a regression;
+    # single workflows take microseconds, and are noisier
+    regressions = []
+
+    for k, b in sorted(baseline.items()):
+        if k not in metrics:
+            continue
+
+        t = workflow_threshold if k.startswith("workflow.") else threshold
+
+        if metrics[k] < b * (1 - t):
+            regressions.append(f"{k}: {metrics[k]:.4g} < {b:.4g} by {100 * (1 - metrics[k] / b):.0f}%, more than {100 * t:.0f}%")
+
+    return regressions
+
+
+@cli.command()
+@click.option("--n-gcn", default=600)
+@click.option("--n-atel", default=300)
+@click.option("--n-arxiv", default=300)
+@click.option("--repeat", default=3)
+@click.option("--min-s", default=0.5, help="minimal duration of each timed run")
+@click.option("--baseline", default="bench-baseline.json")
+@click.option("--save-baseline", is_flag=True, default=False)
+@click.option("--threshold", default=0.25, help="allowed fractional loss of throughput")
+@click.option("--workflow-threshold", default=0.5, help="allowed fractional loss of throughput of single workflows")
+@click.option("--output", "-o", default=None, help="write measured throughputs")
+def run(n_gcn, n_atel, n_arxiv, repeat, min_s, baseline, save_baseline, threshold, workflow_threshold, output):
+    logging.getLogger().setLevel(logging.WARNING)
+
+    metrics = run_benchmarks(corpus(n_gcn, n_atel, n_arxiv), repeat, min_s)
+
+    for k, v in sorted(metrics.items()):
+        print(f"{k:80s} {v:12.1f}")
+
+    if output is not None:
+        json.dump(metrics, open(output, "w"), indent=4, sort_keys=True)
+
+    if save_baseline:
+        json.dump(metrics, open(baseline, "w"), indent=4, sort_keys=True)
+        print(f"saved baseline {baseline}")
+        return
+
+    if not os.path.exists(baseline):
+        print(f"no baseline {baseline}, save one with --save-baseline")
+        return
+
+    regressions = compare(metrics, json.load(open(baseline)), threshold, workflow_threshold)
+
+    for r in regressions:
+        print("REGRESSION", r)
+
+    if len(regressions) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,107 @@
+import logging
+import typing
+import hashlib
+import inspect
+import functools
+import json
+import os
+import pickle
+import sys
+import sqlite3
+import threading
+
+logger = logging.getLogger()
+
+# part of every workflow version: changed when the cached outputs, or the way they are stored, change
+CACHE_SCHEMA = 2
+
+
+def input_hash(input_value) -> str:
+    if isinstance(input_value, str):
+        b = input_value.encode('utf-8', 'replace')
+    else:
+        b = json.dumps(input_value, sort_keys=True, default=repr).encode()
+
+    return hashlib.sha224(b).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def module_source(name) -> bytes:
+    try:
+        return inspect.getsource(sys.modules[name]).encode()
+    except (KeyError, OSError, TypeError):
+        return b""
+
+
+@functools.lru_cache(maxsize=None)
+def workflow_version(f) -> str:
+    # the workflow, the module with the derived views and helpers it calls, and the common helpers
+    try:
+        code = inspect.getsource(f).encode()
+    except (OSError, TypeError):
+        code = f.__code__.co_code
+
+    h = hashlib.sha224(f"{CACHE_SCHEMA}".encode())
+    h.update(code)
+    h.update(module_source(f.__module__))
+    h.update(module_source('facts.common'))
+
+    return h.hexdigest()[:16]
+
+
+class FactCache:
+    # outputs of each workflow for each document, valid as long as the document text and the workflow code are the same
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, and per process, since connections do not survive fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            c = sqlite3.connect(self.path, timeout=60)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("""CREATE TABLE IF NOT EXISTS workflow_output (
+                            doc_id TEXT,
+                            workflow TEXT,
+                            input_hash TEXT,
+                            version TEXT,
+                            output BLOB,
+                            PRIMARY KEY (doc_id, workflow)
+                        )""")
+            c.commit()
+            self._local.connection = c
+            self._local.pid = os.getpid()
+
+        return self._local.connection
+
+    def lookup(self, doc_id, doc_input_hash) -> typing.Dict[str, typing.Tuple[str, typing.Any]]:
+        r = {}
+
+        for workflow, version, output in self._connection().execute(
+                    "SELECT workflow, version, output FROM workflow_output WHERE doc_id=? AND input_hash=?",
+                    (doc_id, doc_input_hash)):
+            if isinstance(output, str):
+                # stored as JSON before CACHE_SCHEMA 2
+                continue
+
+            r[workflow] = (version, pickle.loads(output))
+
+        return r
+
+    def store(self, doc_id, doc_input_hash, outputs):
+        rows = []
+
+        for workflow, version, output in outputs:
+            # pickled, so that the outputs come back as they were returned, tuples included
+            try:
+                rows.append((doc_id, workflow, doc_input_hash, version, pickle.dumps(output)))
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                logger.debug("not caching %s for %s: %s", workflow, doc_id, e)
+
+        c = self._connection()
+        with c:
+            c.executemany("INSERT OR REPLACE INTO workflow_output VALUES (?, ?, ?, ?, ?)", rows)
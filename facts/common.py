@@ -1,4 +1,5 @@
 from collections import defaultdict
+import functools
 import re
 import typing
 from facts.core import workflow
@@ -34,47 +35,118 @@ def cites_atel_gcn(title, body):
         
     return d
 
+# kinds of named objects, and how the name continues after the kind
+named_event_patterns = [
+        (["IceCube", "IC", "GRB", "FRB", "PKS", "Mrk", "HAWC"], r'([ -]?)([0-9\.\-\+]{2,}[A-Z]?)\b', "{}{}{}"),
+        (["AT"], r' *?([0-9]{4}[a-z]{3})\b', "{}{}"),
+        (["ZTF"], r'([0-9]{2}[a-z]{7})\b', "{}{}"),
+    ]
+
+
+def first_chars_lookahead(words) -> str:
+    # lets the regex engine skip quickly to positions where one of the words can start
+    return "(?=[" + "".join(sorted(set(re.escape(w[0]) for w in words))) + "])"
+
+
+@functools.lru_cache(maxsize=None)
+def named_event_matcher():
+    # one scan for all patterns; they can not match at overlapping positions, 
+    # so this finds the same events as a separate scan per pattern
+    parts = []
+    groups = {}
+    n = 0
+
+    for kinds, rest, name_format in named_event_patterns:
+        pattern = "(" + "|".join(kinds) + ")" + rest
+        n_inner = re.compile(pattern).groups
+        parts.append(f"({pattern})")
+        groups[n + 1] = (n_inner, name_format)
+        n += 1 + n_inner
+
+    all_kinds = [k for kinds, rest, name_format in named_event_patterns for k in kinds]
+
+    return re.compile(first_chars_lookahead(all_kinds) + r"\b(?:" + "|".join(parts) + ")"), groups
+
+
 def mentions_grblike(title, body):
     d = defaultdict(list) 
 
+    pattern, groups = named_event_matcher()
+
     for text in title, body:
-        for pattern, name_format in [
-                (r'\b(IceCube|IC|GRB|FRB|PKS|Mrk|HAWC)([ -]?)([0-9\.\-\+]{2,}[A-Z]?)\b', "{}{}{}"),
-                (r'\b(AT) *?([0-9]{4}[a-z]{3})\b', "{}{}"),
-                (r'\b(ZTF)([0-9]{2}[a-z]{7})\b', "{}{}")
-            ]:
-        
-            for r in re.findall(pattern, text):
-                if isinstance(r, str):
-                    r = [r]
+        for m in pattern.finditer(text):
+            n_inner, name_format = groups[m.lastindex]
+            r = m.groups()[m.lastindex: m.lastindex + n_inner]
 
-                full_name = name_format.format(*r).replace(' ', '')
-                obj_kind_type = r[0]
-                d['mentions_named_event'].append(full_name)
-                d['mentions_named_event_type'].append(obj_kind_type)
+            full_name = name_format.format(*r).replace(' ', '')
+            obj_kind_type = r[0]
+            d['mentions_named_event'].append(full_name)
+            d['mentions_named_event_type'].append(obj_kind_type)
 
-                d[f'mentions_named_{obj_kind_type.lower()}'].append(full_name)
+            d[f'mentions_named_{obj_kind_type.lower()}'].append(full_name)
     return d
 
 
+@functools.lru_cache(maxsize=None)
+def keyword_matcher(keywords: tuple):
+    # one scan finds the longest keyword at each match; keywords which may start inside it 
+    # (including itself and its prefixes), like "GRB" in "SGRB", are checked directly at these offsets
+    ordered = sorted(set(keywords), key=len, reverse=True)
+
+    pattern = re.compile("|".join(re.escape(k) for k in ordered))
+
+    overlapping = {}
+    for k in ordered:
+        overlapping[k] = [(offset, _k) 
+                          for offset in range(1, len(k)) 
+                          for _k in ordered 
+                          if k[offset:offset + len(_k)] == _k[:len(k) - offset]]
+        overlapping[k] = [(0, _k) for _k in ordered if k.startswith(_k)] + overlapping[k]
+
+    return pattern, overlapping
+
+
+def count_keywords(text, keywords: tuple) -> typing.Dict[str, int]:
+    pattern, overlapping = keyword_matcher(keywords)
+
+    n = defaultdict(int) # type: typing.Dict[str, int]
+    end = {} # type: typing.Dict[str, int]
+
+    for m in pattern.finditer(text):
+        start = m.start()
+
+        for offset, k in overlapping[m.group()]:
+            # occurrences of the same keyword do not overlap, as in re.findall
+            if start + offset >= end.get(k, 0) and text.startswith(k, start + offset):
+                n[k] += 1
+                end[k] = start + offset + len(k)
+
+    return n
+
+
 def mentions_keyword(title, body):  # ->$                                                                                                                                                                
     d = {} # type: typing.Dict[str, typing.Union[str, int]]    
 
-    for keyword in relevant_keywords():
+    keywords = tuple(relevant_keywords())
+
+    n_body = count_keywords(body, keywords)
+    n_title = count_keywords(title, keywords)
+
+    for keyword in keywords:
         k = keyword.lower()
 
-        n = len(re.findall(keyword, body))        
+        n = n_body[keyword]
         if n > 0:
             d['mentions_'+k] = "body"
         if n > 1:
             d['mentions_'+k+'_times'] = n
 
 
-        nt = len(re.findall(keyword, title))        
+        nt = n_title[keyword]
         if nt > 0:
             d['mentions_'+k] = "title"
         if nt > 1:
             d['mentions_'+k+'_times'] = n
 
 
-    return d
\ No newline at end of file
+    return d
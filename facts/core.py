@@ -11,12 +11,26 @@ import requests
 import feedparser # type: ignore
 import click
 import rdflib # type: ignore
+from rdflib.plugins.serializers import nt # type: ignore
 import time
+import os
+import gzip
+import heapq
+import tempfile
+import importlib
+import functools
 import multiprocessing
 import threading
+import signal
+import contextlib
+import array
+import math
+import zlib
+import inspect
 from colorama import Fore, Style # type: ignore
 
 import facts
+from facts import cache, stats, snapshot
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(levelname)s %(threadName)s %(name)s %(message)s"
@@ -28,17 +42,110 @@ logger = logging.getLogger()
 
 workflow_context = []
 
+# persistent cache of workflow outputs, facts.cache.FactCache, enabled by learn
+fact_cache = None # type: typing.Optional[cache.FactCache]
+
+# timing and outcome of workflow calls
+workflow_stats = stats.WorkflowStats()
+
+# wall time allowed to each workflow call, and to all workflows of one input, set by learn
+workflow_budget_s = None # type: typing.Optional[float]
+document_budget_s = None # type: typing.Optional[float]
+
+# input type -> workflows taking it, and identity function of this input type
+workflows_by_type = defaultdict(list) # type: typing.Dict[typing.Any, typing.List[dict]]
+identity_by_type = {} # type: typing.Dict[typing.Any, typing.Callable]
+
+
+def workflow_input_types(w):
+    return [v for k, v in w['signature'].items() if k != 'return']
+
 
 def workflow(f):
     setattr(sys.modules[f.__module__], f.__name__[1:], f)
-    workflow_context.append(dict(
+    w = dict(
                 name=f.__name__, 
                 function=f,
                 signature=f.__annotations__,
-            ))
+                prefilter=getattr(f, 'prefilter', None),
+                relevance=getattr(f, 'relevance', False),
+            )
+    workflow_context.append(w)
+
+    for input_type in workflow_input_types(w):
+        workflows_by_type[input_type].append(w)
+
+        if w['name'] == 'identity':
+            identity_by_type[input_type] = f
+
+    return f
+
+
+def prefilter(predicate):
+    # cheap test of the input, applied below @workflow: the workflow is skipped for inputs failing it.
+    # the predicate should hold for every input the workflow can find facts in, and is evaluated once per input
+    def decorator(f):
+        f.prefilter = predicate
+        return f
+
+    return decorator
+
+
+def relevance(f):
+    # cheap workflow deciding if the input is valuable, see workflows_for_input: relevance workflows run first,
+    # and the others only for inputs in which they found "mentions" facts
+    f.relevance = True
     return f
 
 
+class BoringDocument(Exception):
+    # raised by a workflow to abort the processing of the input, which then gives no facts
+    pass
+
+
+class WorkflowTimeout(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def time_budget(budget_s):
+    # interrupts the call when the budget is over. Only possible in the main thread, where the signal is handled, as
+    # in process executor workers: regular expressions check for signals while matching.
+    # elsewhere the overrun is only noticed when the call returns
+    if budget_s is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise WorkflowTimeout(f"over budget of {budget_s:.3g} s")
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, budget_s)
+
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def valuable(facts) -> bool:
+    return any('mentions' in k for k in facts.predicate_names())
+
+
+def remove_workflow(name):
+    global workflow_context
+
+    workflow_context = [w for w in workflow_context if w['name'] != name]
+
+    for input_type, ws in list(workflows_by_type.items()):
+        workflows_by_type[input_type] = [w for w in ws if w['name'] != name]
+
+    for input_type, f in list(identity_by_type.items()):
+        if f.__name__ == name:
+            del identity_by_type[input_type]
+
+
 @click.group()
 @click.option("--debug", "-d", default=False, is_flag=True)
 def cli(debug=False):
@@ -49,107 +156,379 @@ from typing import TypeVar
 
 InputType = TypeVar('InputType')
 
+class DocumentHandle(typing.NamedTuple):
+    # lightweight reference to an input, loaded where it is processed, e.g. in a worker process
+    loader: str
+    key: typing.Any
+
+    def load(self):
+        module_name, function_name = self.loader.split(":")
+        return getattr(importlib.import_module(module_name), function_name)(self.key)
+
+
+input_views = threading.local()
+
+
+def derived_view(f):
+    # text derived from the input, computed at most once per input processed by workflows_for_input
+    @functools.wraps(f)
+    def view(input_value):
+        memo = getattr(input_views, 'memo', None)
+
+        if memo is None or memo[0] is not input_value:
+            return f(input_value)
+
+        if f not in memo[1]:
+            memo[1][f] = f(input_value)
+
+        return memo[1][f]
+
+    return view
+
+
 def workflow_id(entry):
     input_type = entry['arg_type']
     input_value = entry['arg']
 
     default = "http://odahub.io/ontology/paper#problematic"+input_type.__name__+hashlib.sha224(repr(input_value).encode()).hexdigest()[:8]
 
-    for w in workflow_context:
-        logger.info('searching for identity %s', w)
-        if input_type in w['signature'].values() and w['name'] == 'identity':
-            try:
-                return w['function'](input_value)
-            except Exception as e:
-                logger.debug('problem: %s', e)
-                raise
+    identity = identity_by_type.get(input_type, None)
+
+    if identity is None:
+        return default
+
+    try:
+        return identity(input_value)
+    except Exception as e:
+        logger.debug('problem: %s', e)
+        raise
+
+
+def fact_n3(fact) -> str:
+    return " ".join(t.n3() for t in fact)
+
+
+xsd_integer = "http://www.w3.org/2001/XMLSchema#integer"
+xsd_double = "http://www.w3.org/2001/XMLSchema#double"
+
+
+def literal_nt(v) -> str:
+    # N-Triples form of rdflib.Literal(v), as written by rdflib.plugins.serializers.nt, without making the Literal
+    # for the common value types
+    t = type(v)
+
+    if t is str:
+        return '"' + v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"').replace("\r", "\\r") + '"'
+
+    if t is int:
+        return f'"{v}"^^<{xsd_integer}>'
+
+    if t is float and math.isfinite(v):
+        return f'"{v!r}"^^<{xsd_double}>'
+
+    return nt._quoteLiteral(rdflib.Literal(v))
+
+
+def literal_value(v):
+    # value of rdflib.Literal(v)
+    if type(v) in (str, int, float):
+        return v
+
+    return rdflib.Literal(v).value
+
+
+# predicate names of facts, interned once per process
+predicate_names = [] # type: typing.List[str]
+predicate_ids = {} # type: typing.Dict[str, int]
+predicate_lock = threading.Lock()
 
-    return default
+
+def predicate_id(name) -> int:
+    i = predicate_ids.get(name)
+
+    if i is None:
+        with predicate_lock:
+            i = predicate_ids.get(name)
+
+            if i is None:
+                predicate_names.append(sys.intern(name))
+                i = predicate_ids[name] = len(predicate_names) - 1
+
+    return i
+
+
+@functools.lru_cache(maxsize=None)
+def predicate_uri(ns, i) -> rdflib.URIRef:
+    return rdflib.URIRef(f'{ns}#{predicate_names[i]}')
+
+
+@functools.lru_cache(maxsize=None)
+def predicate_n3(ns, i) -> str:
+    return predicate_uri(ns, i).n3()
+
+
+class DocumentFacts:
+    # facts of one document, with the subject kept once, predicates as interned ids and values as given by workflows.
+    # iterating gives rdflib triples; N-Triples rows and dict output are made without them
+
+    __slots__ = ('ns', 'id', 'p', 'values')
+
+    def __init__(self, ns, id):
+        self.ns = ns
+        self.id = id
+        self.p = array.array('I')
+        self.values = [] # type: typing.List[typing.Any]
+
+    def append(self, k, v):
+        self.p.append(predicate_id(k))
+        self.values.append(v)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self) -> typing.Iterator[tuple]:
+        s = rdflib.URIRef(f'{self.ns}#{self.id}')
+
+        for i, v in zip(self.p, self.values):
+            yield s, predicate_uri(self.ns, i), rdflib.Literal(v)
+
+    def __eq__(self, other):
+        if not isinstance(other, DocumentFacts):
+            return NotImplemented
+
+        return self.__getstate__() == other.__getstate__()
+
+    __hash__ = None # type: ignore
+
+    def predicate_names(self) -> typing.Set[str]:
+        return {predicate_names[i] for i in set(self.p)}
+
+    def ntriples_rows(self) -> typing.List[str]:
+        s = rdflib.URIRef(f'{self.ns}#{self.id}').n3()
+
+        return [f"{s} {predicate_n3(self.ns, i)} {literal_nt(v)} .\n" for i, v in zip(self.p, self.values)]
+
+    def as_dict(self) -> dict:
+        prefix = "paper:" if self.ns == "http://odahub.io/ontology/paper" else self.ns + "#"
+        D = defaultdict(list)
+
+        for i, v in zip(self.p, self.values):
+            D[prefix + predicate_names[i]].append(literal_value(v))
+
+        return {k: v[0] if len(v) == 1 else list(sorted(set(v))) for k, v in D.items()}
+
+    def __getstate__(self):
+        # ids are only valid in the process which interned them
+        return self.ns, self.id, [predicate_names[i] for i in self.p], self.values
+
+    def __setstate__(self, state):
+        self.ns, self.id, names, self.values = state
+        self.p = array.array('I', map(predicate_id, names))
+
+
+def ntriples_rows(triples) -> typing.List[str]:
+    if isinstance(triples, DocumentFacts):
+        return triples.ntriples_rows()
+
+    return [nt._nt_row(fact) for fact in triples]
+
+
+def facts_graph(facts) -> rdflib.Graph:
+    # triples are added to the store as they are, there is no need to round-trip them through SPARQL
+    G = rdflib.Graph()
+    G.bind('paper', rdflib.Namespace('http://odahub.io/ontology/paper#'))
+
+    for fact in facts:
+        logger.debug("adding %s", fact)
+        G.add(fact)
+
+    return G
+
+
+def serialize_graph(G, format='n3') -> str:
+    r = G.serialize(format=format)
+
+    if isinstance(r, bytes):
+        return r.decode()
+    else:
+        return r
+
+
+def load_input(entry):
+    if isinstance(entry['arg'], DocumentHandle):
+        return dict(entry, arg=entry['arg'].load())
+
+    return entry
 
 
 def workflows_for_input(entry, output: str='list') -> typing.Union[dict, tuple, str]:
+    try:
+        entry = load_input(entry)
+    except Exception as e:
+        logger.warning(f"unable to load {entry['arg']}: {repr(e)}")
+        return str(entry['arg']), []
+
     input_type = entry['arg_type']
     input_value = entry['arg']
 
     c_ns, c_id = workflow_id(entry).split("#")
 
+    if fact_cache is not None:
+        doc_input_hash = cache.input_hash(input_value)
+        cached = fact_cache.lookup(f"{c_ns}#{c_id}", doc_input_hash)
+    else:
+        cached = {}
 
-    facts = []
+    new_outputs = []
 
-    for w in workflow_context:
-        logger.debug(f"{Fore.BLUE} {w['name']} {Style.RESET_ALL}")
-        logger.debug(f"   has " + " ".join([f"{k}:" + getattr(v, "__name__","?") for k,v in w['signature'].items()]))
+    facts = DocumentFacts(c_ns, c_id)
 
-        if input_type not in w['signature'].values():
-            logger.debug(f"   skipping, need " + getattr(input_type, "__name__","?"))
-            continue
+    prefilter_results = {} # type: typing.Dict[typing.Callable, bool]
 
-        try:
-            o = w['function'](input_value)
+    workflows = workflows_by_type.get(input_type, [])
+    relevance_workflows = [w for w in workflows if w.get('relevance')]
+    boring = None
+    deadline = None if document_budget_s is None else time.perf_counter() + document_budget_s
 
-            if len(o) == 0:
-                logger.debug(f"   {Fore.YELLOW} empty:  {Style.RESET_ALL} {c_id} {w['name']} {o}")
-                continue
-            else:
-                logger.debug(f"   {Fore.GREEN} found:  {Style.RESET_ALL} {c_id} {w['name']} {o}")
+    # derived views of this input, dropped when it is done, however it ends
+    input_views.memo = (input_value, {})
+
+    try:
+        for i, w in enumerate(relevance_workflows + [w for w in workflows if not w.get('relevance')]):
+            # input types without relevance workflows, e.g. of plugins, are not judged before their workflows run
+            if i == len(relevance_workflows) and len(relevance_workflows) > 0 and not valuable(facts):
+                break
+
+            logger.debug(f"{Fore.BLUE} {w['name']} {Style.RESET_ALL}")
+
+            stats_name = f"{w['function'].__module__}.{w['name']}"
 
-            for k, v in o.items():
-                if isinstance(v, list):
-                    vs = v
+            if w.get('prefilter') is not None:
+                if w['prefilter'] not in prefilter_results:
+                    try:
+                        prefilter_results[w['prefilter']] = bool(w['prefilter'](input_value))
+                    except Exception as e:
+                        logger.debug(f"  {Fore.YELLOW} prefilter problem {Style.RESET_ALL} {repr(e)}")
+                        prefilter_results[w['prefilter']] = True
+
+                if not prefilter_results[w['prefilter']]:
+                    workflow_stats.record_skipped(stats_name)
+                    continue
+            n_facts = len(facts)
+            from_cache = False
+            t0 = time.perf_counter()
+            duration_s = None
+
+            try:
+                if fact_cache is not None:
+                    version = cache.workflow_version(w['function'])
+
+                if w['name'] in cached and cached[w['name']][0] == version:
+                    o = cached[w['name']][1]
+                    from_cache = True
                 else:
-                    vs = [v]
+                    budget_s = workflow_budget_s
+
+                    if deadline is not None:
+                        budget_s = min(deadline - t0, float('inf') if budget_s is None else budget_s)
+
+                        if budget_s <= 0:
+                            raise WorkflowTimeout("document over budget")
+
+                    with time_budget(budget_s):
+                        o = workflow_stats.call(stats_name, w['function'], input_value)
+                    duration_s = time.perf_counter() - t0
+
+                    if budget_s is not None and duration_s > budget_s:
+                        raise WorkflowTimeout(f"over budget of {budget_s:.3g} s")
 
-                for _v in vs:
-                    # try:
-                    #     _v = float(_v)
-                    # except:
-                    #     pass
+                    if fact_cache is not None:
+                        new_outputs.append((w['name'], version, o))
 
-                    _v = rdflib.Literal(_v).n3()
+                if len(o) == 0:
+                    logger.debug(f"   {Fore.YELLOW} empty:  {Style.RESET_ALL} {c_id} {w['name']} {o}")
+                    outcome = 'empty'
+                else:
+                    logger.debug(f"   {Fore.GREEN} found:  {Style.RESET_ALL} {c_id} {w['name']} {o}")
+                    outcome = 'found'
+
+                    for k, v in o.items():
+                        if isinstance(v, list):
+                            vs = v
+                        else:
+                            vs = [v]
+
+                        for _v in vs:
+                            # try:
+                            #     _v = float(_v)
+                            # except:
+                            #     pass
+
+                            facts.append(k, _v)
+
+            except BoringDocument as e:
+                logger.debug(f"  {Fore.YELLOW} boring {Style.RESET_ALL} {repr(e)}")
+                outcome = type(e).__name__
+                boring = w['name']
+
+            except WorkflowTimeout as e:
+                logger.warning(f"{c_id} {w['name']}: {e}")
+                outcome = 'timeout'
+
+            except Exception as e: 
+                logger.debug(f"  {Fore.YELLOW} problem {Style.RESET_ALL} {repr(e)}")
+                outcome = type(e).__name__
+
+            if from_cache:
+                workflow_stats.record_cached(stats_name, len(facts) - n_facts)
+            else:
+                if duration_s is None:
+                    duration_s = time.perf_counter() - t0
 
-                    data = rdflib.URIRef(f'<{c_ns}#{c_id}>'), f'<{c_ns}#{k}>', f'{_v}'
+                workflow_stats.record(stats_name, duration_s, outcome, len(facts) - n_facts, doc=c_id)
 
-                    facts.append(data)
+            if boring is not None:
+                break
 
-        except Exception as e: 
-            logger.debug(f"  {Fore.YELLOW} problem {Style.RESET_ALL} {repr(e)}")
+            if deadline is not None and time.perf_counter() >= deadline:
+                logger.warning(f"{c_id}: over document budget of {document_budget_s} s, remaining workflows are not run")
+                break
+    finally:
+        input_views.memo = None
 
+    if fact_cache is not None and len(new_outputs) > 0:
+        fact_cache.store(f"{c_ns}#{c_id}", doc_input_hash, new_outputs)
 
-    logger.info(f"{c_id} facts {len(facts)}")
+    logger.info(f"{c_id} facts {len(facts)}, ran {len(new_outputs) if fact_cache is not None else 'all'} workflows")
+
+    if boring is not None:
+        logger.debug(f"paper {Fore.RED}boring{Style.RESET_ALL} for {boring}")
+        return c_id, []
 
     # valuable?
-    if not any(['mentions' in (" ".join(f)) for f in facts]):
-        logger.debug(f"paper {Fore.RED}not valuable{Style.RESET_ALL}: %s", [" ".join(f) for f in facts])
+    if not valuable(facts):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"paper {Fore.RED}not valuable{Style.RESET_ALL}: %s", [fact_n3(f) for f in facts])
         return c_id, []
 
     if output == 'list':
-        return c_id, [" ".join(f) for f in facts]
+        return c_id, [fact_n3(f) for f in facts]
+
+    if output == 'triples':
+        return c_id, facts
     
     if output == 'dict':
-        D = defaultdict(list)
-        for s, p, o in facts:
-            D[p.replace("http://odahub.io/ontology/paper#", "paper:").strip("<>")].append(rdflib.util.from_n3(o).value)
-
-        return {k: v[0] if len(v) == 1 else list(sorted(set(v))) for k, v in D.items()}
+        return facts.as_dict()
 
     if output == 'n3':
-        G = rdflib.Graph()
+        G = facts_graph(facts)
 
-        for s in facts:
-            G.update(f'INSERT DATA {{ {" ".join(s)} }}')
-
-        return G.serialize(format='n3').decode()
+        return serialize_graph(G)
 
     raise Exception(f"unknown output {output}")
 
 
-def workflows_by_input(nthreads=1, input_types=None, max_inputs=None):
-    logger.info("searching for input list...")
-
-    collected_inputs = []
-
-    t0 = time.time()
-
+def input_generators(input_types):
     for w in workflow_context:
         logger.debug(f"{Fore.BLUE} {w['name']} {Style.RESET_ALL}")
         logger.debug(f"   has " + " ".join([f"{k}:" + getattr(v, "__name__","?") for k,v in w['signature'].items()]))
@@ -167,63 +546,278 @@ def workflows_by_input(nthreads=1, input_types=None, max_inputs=None):
 
         logger.info(f"{Fore.YELLOW} valid input generator for {Fore.MAGENTA} {larg.__name__} : {w['function']} {Style.RESET_ALL} {Style.RESET_ALL}")
 
-        for i, arg in enumerate(w['function']()):
-            collected_inputs.append(dict(arg_type=larg, arg=arg))
+        yield larg, w['function']
+
+
+def input_key(entry) -> str:
+    arg = entry['arg']
+
+    if isinstance(arg, DocumentHandle):
+        return f"{arg.loader}:{arg.key!r}"
+
+    try:
+        return workflow_id(entry)
+    except Exception:
+        return repr(arg)
+
+
+def key_shard(key, n_shards) -> int:
+    # same in every process and run, unlike hash()
+    return zlib.crc32(key.encode()) % n_shards
+
+
+def key_in_shard(key, shard) -> bool:
+    return shard is None or key_shard(key, shard[1]) == shard[0]
+
+
+def shard_of(entry, n_shards) -> int:
+    return key_shard(input_key(entry), n_shards)
+
+
+def generator_takes_shard(generator) -> bool:
+    try:
+        return 'shard' in inspect.signature(generator).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def iter_inputs(input_types, max_inputs=None, shard=None):
+    # with shard=(i, n_shards), only inputs of the i-th shard are given. Generators taking a shard argument select
+    # the inputs of the shard themselves, before loading or fetching anything; the others give all inputs, filtered here
+    n_inputs = 0
+
+    for larg, generator in input_generators(input_types):
+        selects_shard = shard is not None and generator_takes_shard(generator)
+
+        for arg in generator(shard=shard) if selects_shard else generator():
+            entry = dict(arg_type=larg, arg=arg)
+
+            if shard is not None and not selects_shard and shard_of(entry, shard[1]) != shard[0]:
+                continue
+
             logger.debug(f"{Fore.BLUE} input: {Fore.MAGENTA} {str(arg):.100s} {Style.RESET_ALL} {Style.RESET_ALL}")
-         
-        logger.info("collected %d arguments", len(collected_inputs))
+            yield entry
 
-        if max_inputs is not None and len(collected_inputs) > max_inputs:
-            logger.warning(f"selecting only %s", max_inputs)
-            break
+            n_inputs += 1
+            if max_inputs is not None and n_inputs >= max_inputs:
+                logger.warning(f"selecting only %s", max_inputs)
+                return
 
-    logger.info(f"inputs search done in in {time.time()-t0}")
+        logger.info("collected %d arguments", n_inputs)
+
+
+def input_type_by_name(name):
+    for t in workflows_by_type:
+        if getattr(t, "__name__", None) == name:
+            return t
+
+    raise Exception(f"unknown input type {name}")
+
+
+def init_worker(modules, fact_cache_path=None, budgets_s=(None, None)):
+    global fact_cache, workflow_budget_s, document_budget_s
+
+    # each worker process imports workflow modules, including plugins, once
+    for module_name in modules:
+        importlib.import_module(module_name)
+
+    if fact_cache_path is not None:
+        fact_cache = cache.FactCache(fact_cache_path)
+
+    workflow_budget_s, document_budget_s = budgets_s
+
+
+def workflows_for_input_by_type_name(arg_type_name, arg, output):
+    r = workflows_for_input(dict(arg_type=input_type_by_name(arg_type_name), arg=arg), output)
+
+    # stats of the worker process are handed over to the main process with each result
+    return r, workflow_stats.pop()
+
+
+def workflows_for_input_in_thread(entry, output):
+    return workflows_for_input(entry, output), None
+
+
+def make_executor(executor='thread', nthreads=1, modules=()):
+    if executor == 'thread':
+        return futures.ThreadPoolExecutor(max_workers=nthreads)
+
+    if executor == 'process':
+        return futures.ProcessPoolExecutor(max_workers=nthreads, initializer=init_worker, 
+                                           initargs=(list(modules), None if fact_cache is None else fact_cache.path,
+                                                     (workflow_budget_s, document_budget_s)))
+
+    raise Exception(f"unknown executor {executor}")
+
+
+def submit_workflows_for_input(ex, entry, output):
+    if isinstance(ex, futures.ProcessPoolExecutor):
+        if workflow_stats.profile_dir is not None:
+            raise Exception("workflow profiling is only possible with thread executor")
 
+        return ex.submit(workflows_for_input_by_type_name, entry['arg_type'].__name__, entry['arg'], output)
+
+    return ex.submit(workflows_for_input_in_thread, entry, output)
+
+
+def workflows_for_input_result(f):
+    r, worker_stats = f.result()
+
+    if worker_stats is not None:
+        workflow_stats.merge(worker_stats)
+
+    return r
+
+
+def stream_workflows_by_input(nthreads=1, input_types=None, max_inputs=None, max_pending=None, output='triples', 
+                              executor='thread', modules=(), shard=None):
+    # inputs are pulled from the generators only as fast as workers take them,
+    # and results are yielded in order of completion, not in order of input
+    if max_pending is None:
+        max_pending = 2 * nthreads
+
+    t0 = time.time()
+    n_done = 0
+
+    with make_executor(executor, nthreads, modules) as ex:
+        pending = set() # type: typing.Set[futures.Future]
+
+        def completed(return_when):
+            nonlocal pending, n_done
+            done, pending = futures.wait(pending, return_when=return_when)
+            for f in done:
+                n_done += 1
+                c_id, d = workflows_for_input_result(f)
+                logger.debug(f"{c_id} gives: {len(d)}, {n_done} done in {time.time() - t0:.1f} s")
+                yield c_id, d
+
+        for entry in iter_inputs(input_types, max_inputs, shard):
+            pending.add(submit_workflows_for_input(ex, entry, output))
+
+            if len(pending) >= max_pending:
+                yield from completed(futures.FIRST_COMPLETED)
+
+        yield from completed(futures.ALL_COMPLETED)
+
+    logger.info(f"processed {n_done} inputs in {time.time() - t0:.1f} s")
+
+
+def write_ntriples(results, f) -> int:
+    n_facts = 0
+
+    for c_id, triples in results:
+        # same fact may come from several workflows
+        for row in dict.fromkeys(ntriples_rows(triples)):
+            f.write(row)
+            n_facts += 1
+
+        # readers of the file see each document as soon as it is done
+        f.flush()
+
+    return n_facts
+
+
+def open_ntriples(fn, mode="rt", compressed=None):
+    if compressed is None:
+        compressed = fn.endswith(".gz")
+
+    if compressed:
+        return gzip.open(fn, mode, encoding="utf-8")
+
+    return open(fn, mode, encoding="utf-8")
+
+
+def write_sorted_ntriples(results, fn, run_rows=200000, with_snapshot=True) -> int:
+    # rows are sorted in runs written to disk as facts arrive, and merged into the file, gzip-compressed if fn ends with .gz.
+    # duplicates, also those coming from several workflows, are dropped in the merge
+    run_fns = [] # type: typing.List[str]
+    rows = [] # type: typing.List[str]
+
+    def write_run():
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(fn)), prefix=".nt-run-",
+                                         delete=False, encoding="utf-8") as f:
+            f.writelines(sorted(rows))
+            run_fns.append(f.name)
+        rows.clear()
+
+    try:
+        for c_id, triples in results:
+            rows.extend(ntriples_rows(triples))
+
+            if len(rows) >= run_rows:
+                write_run()
+
+        rows.sort()
+
+        runs = [open(run_fn, encoding="utf-8") for run_fn in run_fns]
+
+        try:
+            return merge_sorted_ntriples([rows] + runs, fn, with_snapshot)
+        finally:
+            for run in runs:
+                run.close()
+    finally:
+        for run_fn in run_fns:
+            os.remove(run_fn)
+
+
+def merge_sorted_ntriples(sources, fn, with_snapshot=True) -> int:
+    # sorted N-Triples rows from several sources merged into fn, gzip-compressed if fn ends with .gz, without duplicates
+    writer = snapshot.SnapshotWriter() if with_snapshot else None
+    n_facts = 0
+    last = None
+
+    with open_ntriples(fn + ".tmp", "wt", compressed=fn.endswith(".gz")) as f:
+        for row in heapq.merge(*sources):
+            if row == last:
+                continue
+
+            f.write(row)
+            if writer is not None:
+                writer.add_row(row)
+
+            last = row
+            n_facts += 1
+
+    os.replace(fn + ".tmp", fn)
+
+    if writer is not None:
+        writer.write(fn)
+
+    return n_facts
+
+
+def workflows_by_input(nthreads=1, input_types=None, max_inputs=None, executor='thread', modules=(), on_result=None):
+    logger.info("searching for input list...")
+
+    t0 = time.time()
+
+    collected_inputs = list(iter_inputs(input_types, max_inputs))
+
+    logger.info(f"inputs search done in in {time.time()-t0}")
 
-    Ex = futures.ThreadPoolExecutor
 
     r = []
 
-    with Ex(max_workers=nthreads) as ex:
-        for c_id, d in ex.map(workflows_for_input, collected_inputs):
+    with make_executor(executor, nthreads, modules) as ex:
+        for f in [submit_workflows_for_input(ex, e, 'triples') for e in collected_inputs]:
+            c_id, d = workflows_for_input_result(f)
             logger.debug(f"{c_id} gives: {len(d)}")
             r.append(d)
 
+            if on_result is not None:
+                on_result(c_id, d)
+
     facts = []
     for d in r:
         for s in d:
             facts.append(s)
 
-    logger.info("updating graph..")
-
-    G = rdflib.Graph()
-    G.bind('paper', rdflib.Namespace('http://odahub.io/ontology/paper#'))
+    logger.info("updating graph with %d facts..", len(facts))
 
+    G = facts_graph(facts)
 
-    if False:
-        D  ='INSERT DATA { '+" .\n".join(facts) + '}'
-        logger.debug(D)
-        try:
-            G.update(D)
-        except Exception as e:
-            logger.error(f"problem {e}  adding \"{s}\"")
-            raise Exception()
-    else:
-        for fact in facts:
-            D  = f'INSERT DATA {{ {fact} }}'
-            logger.info(D)
-            try:
-                G.update(D)
-            except Exception as e:
-                logger.error(f"problem {e}  adding \"{D}\"")
-                raise Exception(f"problem {e}  adding \"{D}\"")
-
-    r = G.serialize(format='n3')
-
-    if isinstance(r, bytes):
-        return r.decode()
-    else:
-        return r
+    return serialize_graph(G)
 
 if __name__ == "__main__":
     cli()
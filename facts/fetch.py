@@ -0,0 +1,179 @@
+import logging
+import typing
+import os
+import time
+import json
+import hashlib
+import threading
+import urllib.parse
+from concurrent import futures
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry # type: ignore
+
+logger = logging.getLogger()
+
+# minimal interval between requests to the same host, in seconds
+default_min_interval_s = 0.05
+min_interval_s = {
+    "export.arxiv.org": 3.,
+} # type: typing.Dict[str, float]
+
+pool_size = 16
+timeout_s = 60
+
+_session = None # type: typing.Optional[requests.Session]
+_session_pid = None # type: typing.Optional[int]
+_session_lock = threading.Lock()
+
+_next_request_time = {} # type: typing.Dict[str, float]
+_rate_lock = threading.Lock()
+
+
+def session() -> requests.Session:
+    # one pooled session per process, shared by threads
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], respect_retry_after_header=True)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session_pid = os.getpid()
+
+        return _session
+
+
+def wait_for_host(url):
+    host = urllib.parse.urlparse(url).netloc
+    interval = min_interval_s.get(host, default_min_interval_s)
+
+    with _rate_lock:
+        now = time.time()
+        t = max(now, _next_request_time.get(host, 0))
+        _next_request_time[host] = t + interval
+
+    if t > now:
+        time.sleep(t - now)
+
+
+def get(url, **kwargs) -> requests.Response:
+    url = standin_url(url)
+
+    wait_for_host(url)
+
+    kwargs.setdefault('timeout', timeout_s)
+
+    logger.debug("fetching %s", url)
+
+    return session().get(url, **kwargs)
+
+
+def standin_url(url) -> str:
+    # L2F_HTTP_STANDIN="https://gcn.gsfc.nasa.gov=http://localhost:8000;..." replaces remote services with local ones
+    for rule in os.environ.get("L2F_HTTP_STANDIN", "").split(";"):
+        if "=" in rule:
+            remote, local = rule.split("=", 1)
+            if url.startswith(remote):
+                return local + url[len(remote):]
+
+    return url
+
+
+def http_cache_dir() -> str:
+    return os.environ.get("L2F_HTTP_CACHE", os.path.join(os.getenv("HOME", "/tmp"), ".cache/l2f/http"))
+
+
+class CachedResponse:
+    def __init__(self, url, status_code, content, headers):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self) -> str:
+        encoding = requests.utils.get_encoding_from_headers(requests.structures.CaseInsensitiveDict(self.headers))
+        return self.content.decode(encoding or 'utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def cached_get(url, ttl_s: typing.Optional[float]=3600., **kwargs) -> CachedResponse:
+    # successful responses are kept on disk; within ttl_s (None for never) they are used without asking, 
+    # after that they are revalidated with ETag / Last-Modified. L2F_HTTP_OFFLINE=1 never goes to the network for cached URLs
+    key = hashlib.sha224(url.encode()).hexdigest()
+    meta_fn = os.path.join(http_cache_dir(), key + ".json")
+    body_fn = os.path.join(http_cache_dir(), key + ".body")
+
+    meta = None
+    if os.path.exists(meta_fn) and os.path.exists(body_fn):
+        try:
+            meta = json.load(open(meta_fn))
+        except ValueError:
+            logger.warning("corrupt http cache entry for %s", url)
+
+    if meta is not None:
+        cached = CachedResponse(url, 200, open(body_fn, "rb").read(), meta['headers'])
+
+        if os.environ.get("L2F_HTTP_OFFLINE", "0") == "1" or ttl_s is None or time.time() - meta['fetched_at'] < ttl_s:
+            logger.debug("using cached %s", url)
+            return cached
+
+        headers = dict(kwargs.pop('headers', {}))
+        if 'ETag' in meta['headers']:
+            headers['If-None-Match'] = meta['headers']['ETag']
+        if 'Last-Modified' in meta['headers']:
+            headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        kwargs['headers'] = headers
+
+    r = get(url, **kwargs)
+
+    if r.status_code == 304 and meta is not None:
+        logger.debug("not modified %s", url)
+        response = cached
+    else:
+        response = CachedResponse(url, r.status_code, r.content, 
+                                  {k: r.headers[k] for k in ('ETag', 'Last-Modified', 'Content-Type') if k in r.headers})
+
+        if r.status_code != 200:
+            return response
+
+    os.makedirs(http_cache_dir(), exist_ok=True)
+    tmp = f".tmp-{os.getpid()}-{threading.get_ident()}"
+
+    with open(body_fn + tmp, "wb") as f:
+        f.write(response.content)
+    with open(meta_fn + tmp, "w") as f:
+        json.dump(dict(url=url, fetched_at=time.time(), headers=response.headers), f)
+
+    os.replace(body_fn + tmp, body_fn)
+    os.replace(meta_fn + tmp, meta_fn)
+
+    return response
+
+
+def prefetch(f, items, nthreads=8) -> typing.Generator[typing.Tuple[typing.Any, typing.Any, typing.Optional[Exception]], None, None]:
+    # runs f on items with at most nthreads in flight ahead of the consumer, and yields (item, result, exception) in the order of items
+    with futures.ThreadPoolExecutor(max_workers=nthreads) as ex:
+        pending = [] # type: typing.List[typing.Tuple[typing.Any, futures.Future]]
+
+        def first_done():
+            item, fu = pending.pop(0)
+            try:
+                return item, fu.result(), None
+            except Exception as e:
+                return item, None, e
+
+        for item in items:
+            pending.append((item, ex.submit(f, item)))
+
+            if len(pending) >= 2 * nthreads:
+                yield first_done()
+
+        while len(pending) > 0:
+            yield first_done()
@@ -5,13 +5,18 @@ import re
 import os
 import sys
 import json
+import mmap
+import struct
+import tarfile
+import functools
+import time
 from datetime import datetime
 import requests
 import click
 import rdflib # type: ignore
 from colorama import Fore, Style
-from facts import common
-from facts.core import workflow
+from facts import common, fetch
+from facts.core import workflow, derived_view, prefilter, relevance, BoringDocument, DocumentHandle, input_key, key_in_shard
 
 logger = logging.getLogger()
 
@@ -25,22 +30,183 @@ def cli(debug=False):
         logger.setLevel(logging.DEBUG)
 
 
+gcn_archive_fn = "gcn3.pack"
+gcn_recent_fn = "gcn3-recent.txt"
+
+# circulars which could not be fetched are not asked for again for this long
+gcn_missing_ttl_s = 3600.
+
+
 class NoSuchGCN(Exception):
     "no such"
 
 
-class BoringGCN(Exception):
+class BoringGCN(BoringDocument):
     "boring"
 
 
+# the pack ends with its index, and a trailer with the offset of the index
+gcn_pack_magic = b"GCNPACK1"
+gcn_pack_trailer = struct.Struct("<8sQ")
+
+
+class GCNArchive:
+    # all circulars packed in one file, with an index of their offsets; read through mmap.
+    # data and index are in the same file, replaced at once, so a reader always sees an index matching the data
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.f = open(fn, "rb")
+
+        try:
+            self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            if len(self.data) < gcn_pack_trailer.size:
+                raise ValueError(f"{fn} is too short for a GCN pack")
+
+            magic, index_offset = gcn_pack_trailer.unpack(self.data[-gcn_pack_trailer.size:])
+
+            if magic != gcn_pack_magic:
+                raise ValueError(f"{fn} is not a GCN pack, it may be from an older version: run fetch-tar again")
+
+            self.index = {int(k): v for k, v in json.loads(self.data[index_offset:-gcn_pack_trailer.size]).items()}
+        except Exception:
+            self.close()
+            raise
+
+    def __contains__(self, gcnid):
+        return gcnid in self.index
+
+    def read(self, gcnid) -> bytes:
+        offset, size = self.index[gcnid]
+        return self.data[offset: offset + size]
+
+    def ids(self):
+        return sorted(self.index)
+
+    def close(self):
+        if hasattr(self, 'data'):
+            self.data.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pack_gcn_tar(tar_fn, fn=gcn_archive_fn):
+    index = {}
+
+    with open(fn + ".tmp", "wb") as f:
+        with tarfile.open(tar_fn, "r|gz") as tar:
+            for member in tar:
+                r = re.search(r"(\d+)\.gcn3$", member.name)
+                if not member.isfile() or r is None:
+                    continue
+
+                data = tar.extractfile(member).read()
+                index[int(r.group(1))] = (f.tell(), len(data))
+                f.write(data)
+
+        index_offset = f.tell()
+        f.write(json.dumps(index).encode())
+        f.write(gcn_pack_trailer.pack(gcn_pack_magic, index_offset))
+
+    os.replace(fn + ".tmp", fn)
+
+    logger.info("packed %d GCNs in %s", len(index), fn)
+
+
+@functools.lru_cache(maxsize=None)
+def gcn_archive(fn=gcn_archive_fn) -> typing.Optional[GCNArchive]:
+    if os.path.exists(fn):
+        try:
+            return GCNArchive(fn)
+        except ValueError as e:
+            logger.warning("unable to read GCN archive: %s", e)
+
+    return None
+
+
+def reset_gcn_archive():
+    # the archive was replaced. The cached one is only forgotten, not closed: workers may still be reading it,
+    # it is unmapped when the last of them is done with it
+    gcn_archive.cache_clear()
+
+
+def gcn_url(gcnid) -> str:
+    return "https://gcn.gsfc.nasa.gov/gcn3/%i.gcn3" % int(gcnid)
+
+
+def gcn_fetch_missing(gcnid):
+    # keeps a local copy of circulars not yet in the archive, for gcn_source to find
+    if (gcn_archive() is not None and int(gcnid) in gcn_archive()) or os.path.exists(f"gcn3/{gcnid}.gcn3"):
+        return
+
+    if gcn_recently_missing(gcnid):
+        return
+
+    os.makedirs("gcn3", exist_ok=True)
+
+    try:
+        r = fetch.get(gcn_url(gcnid))
+    except requests.RequestException:
+        open(gcn_missing_fn(gcnid), "w").close()
+        raise
+
+    if r.status_code == 200:
+        with open(f"gcn3/{gcnid}.gcn3.tmp-{os.getpid()}", "wb") as f:
+            f.write(r.content)
+        os.replace(f"gcn3/{gcnid}.gcn3.tmp-{os.getpid()}", f"gcn3/{gcnid}.gcn3")
+    else:
+        # so that gcn_source, in the worker, does not ask again
+        open(gcn_missing_fn(gcnid), "w").close()
+
+
+def gcn_missing_fn(gcnid) -> str:
+    return f"gcn3/{gcnid}.missing"
+
+
+def gcn_recently_missing(gcnid) -> bool:
+    try:
+        return time.time() - os.stat(gcn_missing_fn(gcnid)).st_mtime < gcn_missing_ttl_s
+    except FileNotFoundError:
+        return False
+
+
+def gcn_handle(gcnid) -> DocumentHandle:
+    # loaded by the worker, missing GCNs are reported there
+    return DocumentHandle("facts.gcn:gcn_source", int(gcnid))
+
+
+def gcn_handles(gcnids, shard=None):
+    # circulars are fetched concurrently ahead of the consumer, and yielded in order.
+    # with a shard, circulars of other shards are left out before anything is fetched
+    if shard is not None:
+        gcnids = [i for i in gcnids if key_in_shard(input_key(dict(arg=gcn_handle(i))), shard)]
+
+    for gcnid, _, e in fetch.prefetch(gcn_fetch_missing, gcnids):
+        if e is not None:
+            logger.warning(f"unable to fetch GCN {gcnid}: {repr(e)}")
+
+        yield gcn_handle(gcnid)
+
+
 @workflow
 def gcn_source(gcnid: int, allow_net=True) -> GCNText:
+    archive = gcn_archive()
+
+    if archive is not None and int(gcnid) in archive:
+        return GCNText(archive.read(int(gcnid)).decode('ascii', 'replace'))
+
     try:
         t = open(f"gcn3/{gcnid}.gcn3", "rb").read().decode('ascii', 'replace')
         return GCNText(t)
     except FileNotFoundError:
-        if allow_net:
-            r = requests.get("https://gcn.gsfc.nasa.gov/gcn3/%i.gcn3" % int(gcnid))
+        if allow_net and not gcn_recently_missing(gcnid):
+            r = fetch.get(gcn_url(gcnid))
 
             if r.status_code == 200:
                 t = r.text
@@ -52,7 +218,60 @@ def gcn_source(gcnid: int, allow_net=True) -> GCNText:
 @cli.command("fetch-tar")
 def fetch_tar():
     logger.debug("https://gcn.gsfc.nasa.gov/gcn3/all_gcn_circulars.tar.gz")
-    os.system("curl https://gcn.gsfc.nasa.gov/gcn3/all_gcn_circulars.tar.gz | tar xvzf -")
+    if os.system("curl -f -o all_gcn_circulars.tar.gz https://gcn.gsfc.nasa.gov/gcn3/all_gcn_circulars.tar.gz") != 0:
+        raise RuntimeError("unable to fetch GCN tar")
+
+    pack_gcn_tar("all_gcn_circulars.tar.gz")
+    reset_gcn_archive()
+
+
+@derived_view
+def gcn_text_normalized(gcntext):
+    return re.sub(r"[ \n\r]+", " ", gcntext)
+
+
+@derived_view
+def gcn_text_oneline(gcntext):
+    return gcntext.replace("\n", " ")
+
+
+@derived_view
+def gcn_header(gcntext):
+    header = {}
+
+    for line in gcntext.split("\n\n", 1)[0].splitlines():
+        r = re.match("([A-Z]+):(.*)", line)
+        if r is not None and r.group(1) not in header:
+            header[r.group(1)] = r.group(2).strip()
+
+    return header
+
+
+@derived_view
+def gcn_subject_lines(gcntext) -> typing.List[str]:
+    # lines on which SUBJECT: workflow regexes can match: they are case-insensitive and do not cross lines
+    lines = []
+
+    for r in re.finditer("SUBJECT:", gcntext, re.I):
+        if len(lines) > 0 and r.start() < lines[-1][1]:
+            continue
+
+        end = gcntext.find("\n", r.end())
+        lines.append((gcntext.rfind("\n", 0, r.start()) + 1, len(gcntext) if end < 0 else end))
+
+    return [gcntext[start:end] for start, end in lines]
+
+
+@functools.lru_cache(maxsize=None)
+def subject_matches(pattern):
+    # prefilter of workflows looking for the pattern in the SUBJECT line; the same pattern gives the same predicate,
+    # which is evaluated only once per circular
+    def predicate(gcntext) -> bool:
+        return any(re.search(pattern, line, re.I) is not None for line in gcn_subject_lines(gcntext))
+
+    predicate.__name__ = f"subject_matches({pattern!r})"
+
+    return predicate
 
 
 @workflow
@@ -68,24 +287,39 @@ def identity(gcntext: GCNText):
 
     return common.paperid_to_uri('gcn', gcnid)
 
-@workflow
-def gcn_list_recent() -> typing.Generator[GCNText, None, None]:
-    gt = requests.get("https://gcn.gsfc.nasa.gov/gcn3_archive.html").text
+
+def recent_gcnids() -> typing.List[int]:
+    gt = fetch.cached_get("https://gcn.gsfc.nasa.gov/gcn3_archive.html", ttl_s=600).text
 
     r = re.findall(r"<A HREF=(gcn3/\d{1,5}.gcn3)>(\d{1,5})</A>", gt)
 
     logger.debug(f"results {len(r)}")
 
-    for u, i in reversed(r):
-        logger.debug(f"{u} {i}")
+    return [int(i) for u, i in reversed(r)]
 
-        try:
-            yield gcn_source(i)
-        except NoSuchGCN:
-            logger.warning(f"no GCN: {i}")
+
+@cli.command("fetch-recent")
+def fetch_recent():
+    # the list is rewritten only when it changes, so that the scheduler can tell if there is anything new
+    t = "".join(f"{i}\n" for i in recent_gcnids())
+
+    if os.path.exists(gcn_recent_fn) and open(gcn_recent_fn).read() == t:
+        logger.info("no new recent GCNs")
+        return
+
+    with open(gcn_recent_fn + ".tmp", "w") as f:
+        f.write(t)
+
+    os.replace(gcn_recent_fn + ".tmp", gcn_recent_fn)
+
+
+@workflow
+def gcn_list_recent(shard=None) -> typing.Generator[GCNText, None, None]:
+    yield from gcn_handles(recent_gcnids(), shard)
 
 
 @workflow
+@prefilter(subject_matches("fermi|agile"))
 def gcn_instrument(gcntext: GCNText):
     instruments = []
 
@@ -102,11 +336,13 @@ def gcn_instrument(gcntext: GCNText):
 
 
 @workflow
+@relevance
 def mentions_keyword(gcntext: GCNText):  # ->$                                                                                                                                                                
     return common.mentions_keyword("", gcntext)
 
 
 @workflow
+@relevance
 def mentions_named(entry: GCNText):  # ->
     return common.mentions_grblike("", entry)
 
@@ -142,7 +378,7 @@ def fermi_v2(gcntext: GCNText):  # ->$
     d = {} # type: typing.Dict[str, typing.Union[str, int]]
 
     r = re.search(r"At (?P<grb_date>[0-9:\.]*? UT on [0-9]{1,2} [a-zA-Z]*? [0-9]{4}?).*?, the Fermi Gamma-Ray Burst Monitor \(GBM\) triggered and located (?P<name>GRB [0-9]{6}[A-G])", 
-                   re.sub("[ \n]+", " ", gcntext))
+                   gcn_text_normalized(gcntext))
         
     if r is not None:
         d['grb_isot'] = datetime.strptime(
@@ -162,7 +398,7 @@ def gbm_balrog(gcntext: GCNText):  # ->$
         d['url_json'] = r.group('url_json')
         d['url'] = d['url_json'].replace('/json', '/')
 
-        j_data = requests.get(d['url_json']).json()
+        j_data = fetch.cached_get(d['url_json'], ttl_s=24*3600).json()
 
         d['grb_isot'] = j_data[0]['grb_params'][0]['trigger_timestamp'].replace("Z", "")
         d['gbm_trigger_id'] = int(j_data[0]['grb_params'][0]['trigger_number'])
@@ -178,7 +414,7 @@ def gbm_balrog(gcntext: GCNText):  # ->$
 def swift_detected(gcntext: GCNText):  # ->$                                                                                                                                                                
     d = {} # type: typing.Dict[str, typing.Union[str, int]]
 
-    T = re.sub("\n", " ", gcntext, re.M | re.S)
+    T = gcn_text_oneline(gcntext)
     r = re.search(r"At (.*?) UT, the Swift Burst Alert Telescope \(BAT\) triggered and located (GRB ?.*?) ", 
                   T)
     
@@ -197,7 +433,7 @@ def swift_detected(gcntext: GCNText):  # ->$
 def swift_trigger_id(gcntext: GCNText):  # ->$                                                                                                                                                                
     d = {} # type: typing.Dict[str, typing.Union[str, int]]
 
-    T = re.sub("\n", " ", gcntext, re.M | re.S)
+    T = gcn_text_oneline(gcntext)
     r = re.search(r"SUBJECT: .*?Swift detection", 
                   T)
     
@@ -215,10 +451,15 @@ def swift_trigger_id(gcntext: GCNText):  # ->$
 def gcn_meta(gcntext: GCNText):  # ->
     d = {}
 
+    header = gcn_header(gcntext)
+
     for c in "DATE", "SUBJECT", "NUMBER":
-        r = re.search(c+":(.*)", gcntext)
-        if r is not None:
-            d[c] = r.groups()[0].strip()
+        if c in header:
+            d[c] = header[c]
+        else:
+            r = re.search(c+":(.*)", gcntext)
+            if r is not None:
+                d[c] = r.groups()[0].strip()
 
     d['location'] = f"https://gcn.gsfc.nasa.gov/gcn3/{d['NUMBER']}.gcn3"
     d['title'] = d['SUBJECT']
@@ -235,6 +476,8 @@ def gcn_date(gcntext: GCNText) -> dict:  # date
     return dict(timestamp=t)
 
 @workflow
+@relevance
+@prefilter(subject_matches("grb"))
 def gcn_named(gcntext: GCNText):  # ->
     r = re.search("SUBJECT: *(GRB.*?):.*", gcntext, re.I)
 
@@ -246,6 +489,7 @@ def gcn_named(gcntext: GCNText):  # ->
         return {}
 
 @workflow
+@prefilter(subject_matches("ligo/virgo"))
 def gcn_lvc_event(gcntext: GCNText):  # ->
     D = {}
 
@@ -255,7 +499,7 @@ def gcn_lvc_event(gcntext: GCNText):  # ->
         D['lvc_event'] = r.groups()[0].strip()
     
         r = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d*?) UTC",
-                       re.sub(r"[ \n\r]+", " ", gcntext),
+                       gcn_text_normalized(gcntext),
                        re.I)
 
         if r is not None:
@@ -285,6 +529,7 @@ def gcn_integral_lvc_countepart_search(gcntext: GCNText):  # ->
 
 
 @workflow
+@prefilter(subject_matches("integral"))
 def gcn_integral_countepart_search(gcntext: GCNText):  # ->
 
     r = re.search("SUBJECT:(.*?):.*counterpart.*INTEGRAL", gcntext, re.I)
@@ -319,6 +564,7 @@ def gcn_integral_countepart_search(gcntext: GCNText):  # ->
 
 
 @workflow
+@prefilter(subject_matches("icecube observation of a"))
 def gcn_icecube_circular(gcntext: GCNText):  # ->
     r = re.search("SUBJECT:(.*?) *?:?-? *?IceCube observation of a(.*)",
                   gcntext, re.I)
@@ -340,7 +586,7 @@ def gcn_icecube_circular(gcntext: GCNText):  # ->
         r_notice_url = re.search("(https://gcn.gsfc.nasa.gov/.*?\.amon)", gcntext)
 
         if r_notice_url is not None:
-            gcn_notice_block_text = requests.get(r_notice_url.group(1)).text
+            gcn_notice_block_text = fetch.cached_get(r_notice_url.group(1), ttl_s=None).text
 
             notice_sep = "//////////////////////////////////////////////////////////////////////"
             for gcn_notice_text in gcn_notice_block_text.split(notice_sep):
@@ -416,6 +662,7 @@ def gcn_icecube_circular(gcntext: GCNText):  # ->
 
 
 @workflow
+@prefilter(subject_matches("ligo/virgo .*: identification"))
 def gcn_lvc_circular(gcntext: GCNText):  # ->
     r = re.search("SUBJECT:.*?(LIGO/Virgo .*?): Identification",
                   gcntext, re.I)
@@ -429,19 +676,19 @@ def gcn_lvc_circular(gcntext: GCNText):  # ->
 @workflow
 def integral_ul_old_variation(gcntext: GCNText):
     r = re.search("upper limit .*? ([\d\.e\-]*?) erg/cm.*? for a 1 s duration", 
-                   re.sub(r"[ \n\r]+", " ", gcntext))
+                   gcn_text_normalized(gcntext))
     
     if r is None:
         r = re.search("We find a limiting fluence of ([\d\.e\-]*?) erg/cm", 
-                   re.sub(r"[ \n\r]+", " ", gcntext), re.I)
+                   gcn_text_normalized(gcntext), re.I)
     
     if r is None:
         r = re.search("([\d\.e\-]*?) erg/cm2 for 1 s", 
-                   re.sub(r"[ \n\r]+", " ", gcntext))
+                   gcn_text_normalized(gcntext))
     
     if r is None:
         r = re.search("limiting peak flux is ~([\d\.e\-\^x]*?) erg/cm.*? at 1 s time scale",
-                   re.sub(r"[ \n\r]+", " ", gcntext))
+                   gcn_text_normalized(gcntext))
 
     if r is not None:
         return dict(
@@ -453,7 +700,7 @@ def integral_ul_old_variation(gcntext: GCNText):
 @workflow
 def integral_ul(gcntext: GCNText):
     r = re.search("upper limit on the 75-2000 keV fluence of ([\d\.e\-\^x]*?) *?erg/cm", 
-                   re.sub(r"[ \n\r]+", " ", gcntext))
+                   gcn_text_normalized(gcntext))
 
     if r is not None:
         return dict(
@@ -464,7 +711,7 @@ def integral_ul(gcntext: GCNText):
 
 @workflow
 def clearly_detected_afterglow(gcntext: GCNText):
-    text = re.sub(r"[ \n\r]+", " ", gcntext)
+    text = gcn_text_normalized(gcntext)
     if re.search("clearly detected", text) and re.search("afterglow", text):
         return dict(
                     reports_characteristic='http://odahub.io/ontology/afterglow',
@@ -479,7 +726,7 @@ def cites(gcntext: GCNText):  # ->
 
 @workflow
 def afterglow(gcntext: GCNText):
-    text = re.sub(r"[ \n\r]+", " ", gcntext)
+    text = gcn_text_normalized(gcntext)
     if re.search("afterglow", text):
         return dict(
                     reports_characteristic='http://odahub.io/ontology/afterglow',
@@ -489,6 +736,7 @@ def afterglow(gcntext: GCNText):
 
 
 @workflow
+@prefilter(subject_matches("grb.*integral"))
 def gcn_grb_integral_circular(gcntext: GCNText):  # ->
     r = re.search("SUBJECT:.*?(GRB.*?):.*INTEGRAL.*",
                   gcntext, re.I)
@@ -508,6 +756,7 @@ def gcn_grb_integral_circular(gcntext: GCNText):  # ->
 
 
 @workflow
+@prefilter(subject_matches("ligo/virgo .*integral"))
 def gcn_lvc_integral_counterpart(gcntext: GCNText):  # ->
     r = re.search("SUBJECT:.*?(LIGO/Virgo .*?):.*INTEGRAL",
               gcntext, re.I)
@@ -519,6 +768,7 @@ def gcn_lvc_integral_counterpart(gcntext: GCNText):  # ->
 
 
 @workflow
+@prefilter(subject_matches("hawc"))
 def gcn_hawc(gcntext: GCNText):  # ->
     r = re.search(r"SUBJECT:.*?\b(HAWC[\- ]?[0-9]+?[A-Z]?)\b",
                   gcntext, re.I)
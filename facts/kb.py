@@ -0,0 +1,257 @@
+import logging
+import typing
+import os
+import time
+import json
+import gzip
+from concurrent import futures
+import rdflib # type: ignore
+from rdflib.plugins.serializers import nt # type: ignore
+from facts import snapshot
+
+logger = logging.getLogger()
+
+
+def read_prefixes(fn) -> typing.List[str]:
+    prefixes = []
+
+    with (gzip.open if fn.endswith(".gz") else open)(fn, "rb") as f:
+        for line in f:
+            line = line.decode('utf-8').strip()
+            if line.startswith("@prefix"):
+                prefixes.append(line.replace("@prefix", "PREFIX").strip(".").strip())
+            elif line != "":
+                break
+
+    return prefixes
+
+
+def iter_fact_groups(fn, offset=0) -> typing.Generator[typing.Tuple[int, str], None, None]:
+    # statements of N3 / N-Triples file, with the offset where each ends; multi-line literals are kept together
+    with (gzip.open if fn.endswith(".gz") else open)(fn, "rb") as f:
+        f.seek(offset)
+
+        group = [] # type: typing.List[str]
+        in_literal = False
+
+        for line in f:
+            offset += len(line)
+            line = line.decode('utf-8')
+
+            if line.count('"""') % 2 == 1:
+                in_literal = not in_literal
+
+            if len(group) == 0 and (line.strip() == "" or line.startswith("@prefix")):
+                continue
+
+            group.append(line)
+
+            if not in_literal and line.rstrip().endswith("."):
+                yield offset, "".join(group).strip()
+                group = []
+
+        if len(group) > 0:
+            yield offset, "".join(group).strip()
+
+
+def odakb_update(prefixes, operation="INSERT DATA") -> typing.Callable[[str], typing.Any]:
+    import odakb.sparql # type: ignore
+
+    if "\n".join(prefixes) not in odakb.sparql.LocalGraph.default_prefixes:
+        odakb.sparql.LocalGraph.default_prefixes.append("\n".join(prefixes))
+        odakb.sparql.init()
+
+    def update(body):
+        # odakb posts str data, which is sent as latin-1
+        return odakb.sparql.update(operation + " {\n" + body.encode('utf-8').decode('latin-1') + "\n}")
+
+    return update
+
+
+def odakb_insert(prefixes) -> typing.Callable[[str], typing.Any]:
+    return odakb_update(prefixes, "INSERT DATA")
+
+
+def file_identity(fn) -> dict:
+    st = os.stat(fn)
+    return dict(fn=os.path.abspath(fn), size=st.st_size, mtime=st.st_mtime)
+
+
+def load_checkpoint(fn, checkpoint_fn) -> int:
+    try:
+        checkpoint = json.load(open(checkpoint_fn))
+    except (FileNotFoundError, ValueError):
+        return 0
+
+    if checkpoint.get('file') != file_identity(fn):
+        logger.info("checkpoint %s is for a different file, starting over", checkpoint_fn)
+        return 0
+
+    logger.info("resuming publishing %s from offset %d", fn, checkpoint['offset'])
+    return checkpoint['offset']
+
+
+def save_checkpoint(fn, checkpoint_fn, offset):
+    with open(checkpoint_fn + ".tmp", "w") as f:
+        json.dump({'file': file_identity(fn), 'offset': offset}, f)
+
+    os.replace(checkpoint_fn + ".tmp", checkpoint_fn)
+
+
+def send_chunk(insert, groups: typing.List[str], retries=3, backoff_s=2.) -> float:
+    # failed chunks are retried, and then split, in case they are too large for the endpoint
+    t0 = time.time()
+
+    for attempt in range(retries):
+        try:
+            if insert("\n".join(groups)) is not None:
+                return time.time() - t0
+            logger.warning("insert of %d fact groups failed, attempt %d", len(groups), attempt)
+        except Exception as e:
+            logger.warning("insert of %d fact groups failed, attempt %d: %s", len(groups), attempt, repr(e))
+
+        if len(groups) > 1:
+            break
+
+        time.sleep(backoff_s * 2**attempt)
+
+    if len(groups) <= 1:
+        raise RuntimeError(f"unable to insert {groups}")
+
+    logger.info("splitting chunk of %d fact groups", len(groups))
+    send_chunk(insert, groups[:len(groups)//2], retries, backoff_s)
+    send_chunk(insert, groups[len(groups)//2:], retries, backoff_s)
+
+    return time.time() - t0
+
+
+def publish_file(fn, insert=None, max_in_flight=4, checkpoint_fn=None,
+                 chunk_groups=1000, max_chunk_bytes=4*1024*1024, target_chunk_s=10., retry_backoff_s=2.):
+    if checkpoint_fn is None:
+        checkpoint_fn = fn + ".publish-checkpoint"
+
+    prefixes = read_prefixes(fn)
+
+    if insert is None:
+        insert = odakb_insert(prefixes)
+
+    offset = load_checkpoint(fn, checkpoint_fn)
+    t0 = time.time()
+    n_groups = 0
+
+    with futures.ThreadPoolExecutor(max_workers=max_in_flight) as ex:
+        # chunks in the order they were read; everything before the first unfinished one is checkpointed
+        submitted = [] # type: typing.List[typing.List]
+        pending = {} # type: typing.Dict[futures.Future, typing.List]
+
+        def collect(return_when):
+            nonlocal chunk_groups, pending, n_groups
+
+            done, _ = futures.wait(list(pending), return_when=return_when)
+
+            for fu in done:
+                chunk = pending.pop(fu)
+                duration_s = fu.result()
+                chunk[1] = True
+                n_groups += chunk[2]
+
+                # adapt chunk size to the latency of the endpoint, changing it at most twice at a time
+                ideal_chunk_groups = chunk[2] * target_chunk_s / max(duration_s, 1e-3)
+                chunk_groups = int(max(10, min(chunk_groups * 2, max(chunk_groups / 2, ideal_chunk_groups))))
+
+                logger.info("published chunk of %d fact groups in %.1f s, %d in total, %.1f groups/s; next chunk %d",
+                            chunk[2], duration_s, n_groups, n_groups / (time.time() - t0), chunk_groups)
+
+            while len(submitted) > 0 and submitted[0][1]:
+                save_checkpoint(fn, checkpoint_fn, submitted.pop(0)[0])
+
+        groups = [] # type: typing.List[str]
+        size = 0
+
+        for end_offset, group in iter_fact_groups(fn, offset):
+            groups.append(group)
+            size += len(group)
+
+            if len(groups) >= chunk_groups or size >= max_chunk_bytes:
+                chunk = [end_offset, False, len(groups)]
+                submitted.append(chunk)
+                pending[ex.submit(send_chunk, insert, groups, backoff_s=retry_backoff_s)] = chunk
+                groups, size = [], 0
+
+                if len(pending) >= max_in_flight:
+                    collect(futures.FIRST_COMPLETED)
+
+        if len(groups) > 0:
+            chunk = [end_offset, False, len(groups)]
+            submitted.append(chunk)
+            pending[ex.submit(send_chunk, insert, groups, backoff_s=retry_backoff_s)] = chunk
+
+        while len(pending) > 0:
+            collect(futures.ALL_COMPLETED)
+
+    if os.path.exists(checkpoint_fn):
+        os.remove(checkpoint_fn)
+
+    logger.info("published %d fact groups from %s in %.1f s", n_groups, fn, time.time() - t0)
+
+    return n_groups
+
+
+def ntriples_lines(fn, format="n3") -> typing.Set[str]:
+    # N-Triples written here and by learn --stream are read as they are, without parsing
+    s = snapshot.load(fn)
+    if s is not None:
+        return set(snapshot.ntriples_lines(s))
+
+    if format == "nt" or fn.endswith((".nt", ".nt.gz")):
+        with (gzip.open if fn.endswith(".gz") else open)(fn, "rt", encoding="utf-8") as f:
+            return set(line for line in f if line.strip() != "")
+
+    return set(nt._nt_row(t) for t in rdflib.Graph().parse(fn, format=format))
+
+
+def write_lines(fn, lines):
+    with open(fn + ".tmp", "w") as f:
+        f.writelines(sorted(lines))
+
+    os.replace(fn + ".tmp", fn)
+
+
+def publish_delta(fn, snapshot_fn=None, insert=None, delete=None, max_in_flight=4, **kwargs) -> typing.Tuple[int, int]:
+    # only triples added or removed since the last successful publish are sent; 
+    # the snapshot of what was published is kept as sorted N-Triples, and replaced only when both are through
+    if snapshot_fn is None:
+        snapshot_fn = fn + ".published.nt"
+
+    current = ntriples_lines(fn)
+
+    if os.path.exists(snapshot_fn):
+        previous = ntriples_lines(snapshot_fn, format="nt")
+    else:
+        logger.info("no snapshot of the previous publish in %s, publishing everything", snapshot_fn)
+        previous = set()
+
+    added = current - previous
+    removed = previous - current
+
+    logger.info("publishing %s: %d triples, %d added, %d removed since the last publish", fn, len(current), len(added), len(removed))
+
+    for lines, operation, update in [(removed, "DELETE DATA", delete), (added, "INSERT DATA", insert)]:
+        if len(lines) == 0:
+            continue
+
+        delta_fn = f"{fn}.{operation.split()[0].lower()}.nt"
+
+        # unchanged delta is not rewritten, so that its checkpoint remains valid
+        if not os.path.exists(delta_fn) or ntriples_lines(delta_fn, format="nt") != lines:
+            write_lines(delta_fn, lines)
+
+        if update is None:
+            update = odakb_update(read_prefixes(fn), operation)
+
+        publish_file(delta_fn, insert=update, max_in_flight=max_in_flight, **kwargs)
+        os.remove(delta_fn)
+
+    write_lines(snapshot_fn, current)
+
+    return len(added), len(removed)
@@ -5,6 +5,7 @@ import odakb.sparql # type: ignore
 import re
 import os
 import json
+import glob
 import importlib
 from datetime import datetime
 import requests
@@ -15,6 +16,11 @@ import multiprocessing
 import threading
 from facts.core import workflow
 import facts.core
+import facts.cache
+import facts.kb
+import facts.views
+import facts.snapshot
+import facts.shards
 import facts.arxiv
 import facts.gcn
 import facts.atel
@@ -31,6 +37,8 @@ logger = logging.getLogger()
 
 PaperEntry = typing.NewType("PaperEntry", dict)
 
+loaded_modules = ["facts.arxiv", "facts.gcn", "facts.atel"]
+
 
 @click.group()
 @click.option("--debug", "-d", default=False, is_flag=True)
@@ -42,6 +50,7 @@ def cli(debug=False, modules=[]):
     for module_name in modules:
         logger.info("loading additional module %s", module_name)
         mod = importlib.import_module(module_name)
+        loaded_modules.append(module_name)
 
 
 
@@ -51,7 +60,125 @@ def cli(debug=False, modules=[]):
 @click.option("-a", "--arxiv", is_flag=True, default=False)
 @click.option("-g", "--gcn", is_flag=True, default=False)
 @click.option("-t", "--atel", is_flag=True, default=False)
-def learn(workers, arxiv, gcn, atel):
+@click.option("--stream", is_flag=True, default=False, help="write facts as N-Triples while they are extracted")
+@click.option("--sorted", "sort_output", is_flag=True, default=False, help="with --stream, write sorted N-Triples without duplicates, "
+                                                                          "and a snapshot next to them, once all facts are extracted")
+@click.option("--executor", type=click.Choice(["thread", "process"]), default="thread")
+@click.option("--fact-cache", default=None, help="sqlite file keeping workflow outputs, only new documents and changed workflows are run")
+@click.option("--stats-json", default=None, help="write per-workflow timing and outcome summary")
+@click.option("--stats-prom", default=None, help="write per-workflow metrics in prometheus text format")
+@click.option("--profile-dir", default=None, help="dump cProfile stats for each workflow")
+@click.option("--views", default=None, help="sqlite file with reaction time views, updated for the events of each document")
+@click.option("--output", "-o", default="knowledge.n3", help="with --stream, gzip-compressed if ending with .gz")
+@click.option("--workflow-budget-s", type=float, default=None, help="wall time allowed to each workflow call, over it workflows are interrupted; needs --executor process")
+@click.option("--document-budget-s", type=float, default=None, help="wall time allowed to all workflows of one document")
+@click.option("--shard-queue", default=None, help="sqlite file with input shards, leased by any number of learn workers sharing it. "
+                                                  "facts of each shard are written next to the output, and merged into it when all shards are done")
+@click.option("--shards", default=64, help="number of shards, when making the shard queue")
+@click.option("--lease-s", default=1800., help="time after which a shard whose worker stopped renewing the lease is given to another worker")
+def learn(workers, arxiv, gcn, atel, stream, sort_output, executor, fact_cache, stats_json, stats_prom, profile_dir, views, output,
+          workflow_budget_s, document_budget_s, shard_queue, shards, lease_s):
+    if workflow_budget_s is not None and executor != "process":
+        # the alarm interrupting a workflow is only delivered to the main thread, which runs workflows only in
+        # process executor workers: thread executor workers would notice the overrun only once the call returned
+        raise click.UsageError("--workflow-budget-s needs --executor process, workflows running in threads can not be interrupted")
+
+    facts.core.workflow_budget_s = workflow_budget_s
+    facts.core.document_budget_s = document_budget_s
+
+    if fact_cache is not None:
+        facts.core.fact_cache = facts.cache.FactCache(fact_cache)
+
+    if views is not None:
+        views = facts.views.ReactionViews(views)
+
+    facts.core.workflow_stats.profile_dir = profile_dir
+
+    if shard_queue is not None:
+        shard_queue = facts.shards.ShardQueue(shard_queue, shards, lease_s)
+
+    try:
+        learn_knowledge(workers, arxiv, gcn, atel, stream, executor, views, output, shard_queue, sort_output)
+    finally:
+        if stats_json is not None:
+            facts.core.workflow_stats.write_json(stats_json)
+
+        if stats_prom is not None:
+            facts.core.workflow_stats.write_prometheus(stats_prom)
+
+        facts.core.workflow_stats.dump_profiles()
+
+
+def observed_results(results, on_result):
+    for c_id, d in results:
+        on_result(c_id, d)
+        yield c_id, d
+
+
+def shard_facts_fn(output, shard) -> str:
+    return f"{output}.shards/shard-{shard:05d}.nt"
+
+
+def merge_shards(queue, output) -> int:
+    # the merged file is the same for any number of shards and workers: sorted N-Triples, as learn --stream writes
+    fns = queue.facts_fns()
+    sources = [facts.core.open_ntriples(fn) for fn in fns]
+
+    try:
+        n = facts.core.merge_sorted_ntriples(sources, output)
+    finally:
+        for f in sources:
+            f.close()
+
+    logger.info(f"merged {n} facts of {len(fns)} shards into {output}")
+
+    return n
+
+
+def learn_shards(workers, it, executor, queue, output, on_result=None):
+    # the worker completing the last shard merges the facts of all shards
+    owner = facts.shards.default_owner()
+
+    while True:
+        shard = queue.lease(owner)
+
+        if shard is None:
+            break
+
+        fn = shard_facts_fn(output, shard)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+
+        with queue.leased(shard, owner):
+            results = facts.core.stream_workflows_by_input(workers, input_types=it, executor=executor, modules=loaded_modules,
+                                                           shard=(shard, queue.n_shards))
+
+            if on_result is not None:
+                results = observed_results(results, on_result)
+
+            n = facts.core.write_sorted_ntriples(results, fn, with_snapshot=False)
+
+            left = queue.complete(shard, owner, fn)
+
+        logger.info(f"shard {shard} of {queue.n_shards}: {n} facts in {fn}")
+
+        if left is None:
+            logger.warning(f"shard {shard} was completed by another worker")
+        elif left == 0:
+            merge_shards(queue, output)
+            return
+
+    logger.info(f"no shards left to lease: {queue.progress()}")
+
+
+def output_identity(output) -> typing.Optional[list]:
+    if not os.path.exists(output):
+        return None
+
+    return facts.snapshot.source_identity(output)
+
+
+def learn_knowledge(workers, arxiv, gcn, atel, stream, executor, views=None, output="knowledge.n3", shard_queue=None,
+                    sort_output=False):
     it = []
 
     if arxiv:
@@ -63,96 +190,96 @@ def learn(workers, arxiv, gcn, atel):
     if atel:
         it.append(facts.atel.ATelEntry)
 
-    t = facts.core.workflows_by_input(workers, input_types=it)
+    on_result = None if views is None else views.add_document
+    output_before = output_identity(output)
 
-    logger.info(f"read in total {len(t)}")
+    try:
+        learn_inputs(workers, it, stream, executor, on_result, output, shard_queue, sort_output)
+    finally:
+        if views is not None:
+            views.flush()
 
-    open("knowledge.n3", "w").write(t)
+    # the output written here holds the facts the views were updated with
+    if views is not None and output_identity(output) not in (None, output_before):
+        views.record_source(output)
 
-@cli.command()
-def publish():
 
-    D = open("knowledge.n3").read()
+def learn_inputs(workers, it, stream, executor, on_result, output, shard_queue, sort_output=False):
+    if shard_queue is not None:
+        learn_shards(workers, it, executor, shard_queue, output, on_result)
+        return
 
-    odakb.sparql.LocalGraph.default_prefixes.append("\n".join([d.strip().replace("@prefix","PREFIX").strip(".") for d in D.splitlines() if 'prefix' in d]))
+    if stream:
+        results = facts.core.stream_workflows_by_input(workers, input_types=it, executor=executor, modules=loaded_modules)
 
-    D_g = D.split(".\n")
+        if on_result is not None:
+            results = observed_results(results, on_result)
 
-    logger.info("found knowledge, lines: %d fact groups %d", len(D.splitlines()), len(D_g))
+        if sort_output:
+            n = facts.core.write_sorted_ntriples(results, output)
+        else:
+            # facts of each document are written as soon as it is done
+            with facts.core.open_ntriples(output, "wt") as f:
+                n = facts.core.write_ntriples(results, f)
 
-    chunk_size = 1000
-    
-    for i in range(0, len(D_g), chunk_size):
-        chunk_D = D_g[i:i + chunk_size]
-        logger.info("chunk of knowledge, lines from %d .. + %d / %d", i, len(chunk_D), len(D_g))
+        logger.info(f"streamed in total {n} facts")
+        return
 
-        odakb.sparql.insert(
-                        (".\n".join([d.strip() for d in chunk_D if 'prefix' not in d])).encode('utf-8').decode('latin-1')
-                    )
+    t = facts.core.workflows_by_input(workers, input_types=it, executor=executor, modules=loaded_modules, on_result=on_result)
+
+    logger.info(f"read in total {len(t)}")
+
+    open(output, "w").write(t)
 
+@cli.command("merge-shards")
+@click.option("--shard-queue", default="learn-shards.sqlite")
+@click.option("--output", "-o", default="knowledge.n3")
+def merge_shards_command(shard_queue, output):
+    queue = facts.shards.ShardQueue(shard_queue)
+
+    if not queue.done():
+        raise Exception(f"not all shards are done: {queue.progress()}")
+
+    merge_shards(queue, output)
 
 
 @cli.command()
-def contemplate():
-    G = rdflib.Graph()
+@click.option("--workers", "-w", default=4, help="chunks in flight")
+@click.option("--restart", is_flag=True, default=False, help="ignore checkpoint of previous publish")
+@click.option("--full", is_flag=True, default=False, help="publish all knowledge, not only the changes since the last publish")
+@click.option("--knowledge", default="knowledge.n3")
+def publish(workers, restart, full, knowledge):
+    if restart:
+        for fn in glob.glob(f"{knowledge}*.publish-checkpoint"):
+            os.remove(fn)
+
+    if full:
+        facts.kb.publish_file(knowledge, max_in_flight=workers)
+        facts.kb.write_lines(f"{knowledge}.published.nt", facts.kb.ntriples_lines(knowledge))
+    else:
+        facts.kb.publish_delta(knowledge, max_in_flight=workers)
 
-    G.parse("knowledge.n3", format="n3")
-
-    logger.info(f"parsed {len(list(G))}")
-
-    s = []
-
-    for rep_gcn_prop in "gcn:lvc_event_report", "gcn:reports_icecube_event":
-        for r in G.query("""
-                    SELECT ?c ?ic_d ?ct_d ?t0 ?instr WHERE {{
-                            ?ic_g {rep_gcn_prop} ?c;
-                                  gcn:DATE ?ic_d . 
-                            ?ct_g ?p ?c;
-                                  gcn:DATE ?ct_d;
-                                  gcn:original_event_utc ?t0;
-                                  gcn:instrument ?instr .
-                        }}
-                """.format(rep_gcn_prop=rep_gcn_prop)):
-
-            if r[1] != r[2]:
-                logger.info(r)
-                s.append(dict(
-                    event=str(r[0]),
-                    event_gcn_time=str(r[1]),
-                    counterpart_gcn_time=str(r[2]),
-                    event_t0=str(r[3]),
-                    instrument=str(r[4]),
-                ))
-
-    byevent = dict()
-
-    for i in s:
-        ev = i['event']
-        if ev in byevent:
-            byevent[ev]['instrument'].append(i['instrument'])
-        else:
-            byevent[ev] = i
-            byevent[ev]['instrument'] = [i['instrument']]
 
-    s = list(byevent.values())
+
+@cli.command()
+@click.option("--views", default="facts-views.sqlite", help="sqlite file with reaction time views, kept up to date by learn --views")
+@click.option("--rebuild", is_flag=True, default=False, help="rebuild the views from knowledge")
+@click.option("--knowledge", default="knowledge.n3")
+def contemplate(views, rebuild, knowledge):
+    V = facts.views.ReactionViews(views)
+
+    # views kept up to date by learn --views match the knowledge it wrote; otherwise, e.g. if knowledge was made
+    # without --views, they are rebuilt from it
+    if rebuild or (os.path.exists(knowledge) and not V.source_matches(knowledge)):
+        V.load_graph_file(knowledge)
+
+    s = V.counterpart_summary()
+    logger.info(f"{len(s)} events with counterparts")
 
     json.dump(s, open("counterpart_gcn_reaction_summary.json", "w"))
 
-    s = []
-    for r in G.query("""
-                    SELECT ?grb ?t0 ?gcn_d WHERE {{
-                            ?gcn gcn:integral_grb_report ?grb . 
-                            ?gcn gcn:DATE ?gcn_d . 
-                            ?gcn gcn:event_t0 ?t0 .
-                        }}
-                """):
-        if r[1] != r[2]:
-            logger.info(r)
-            s.append(dict(
-                event=str(r[0]),
-                event_t0=str(r[1]),
-                event_gcn_time=str(r[2]),
-            ))
+    s = V.grb_summary()
+    logger.info(f"{len(s)} grb reports")
 
     json.dump(s, open("grb_gcn_reaction_summary.json", "w"))
 
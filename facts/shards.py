@@ -0,0 +1,138 @@
+import logging
+import typing
+import contextlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger()
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ShardQueue:
+    # shards of the inputs of learn, leased by any number of workers, in processes or pods sharing the file.
+    # a shard whose lease was not renewed, e.g. because its worker died, is leased again to another worker
+
+    def __init__(self, path, n_shards=None, lease_s=1800.):
+        self.path = path
+        self.lease_s = lease_s
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # no WAL, which needs memory shared by the workers: the file may be on a volume shared by pods
+        self.c = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.c.execute("""
+            CREATE TABLE IF NOT EXISTS shard (
+                shard INTEGER PRIMARY KEY,
+                n_shards INTEGER,
+                state TEXT,
+                owner TEXT,
+                lease_until REAL,
+                attempts INTEGER,
+                facts_fn TEXT
+            )
+        """)
+
+        with self.transaction():
+            existing = [n for n, in self.c.execute("SELECT DISTINCT n_shards FROM shard")]
+
+            if len(existing) == 0:
+                if n_shards is None:
+                    raise Exception(f"shard queue {path} is empty, the number of shards is needed to make it")
+
+                self.c.executemany("INSERT INTO shard VALUES (?, ?, 'todo', NULL, 0, 0, NULL)",
+                                   [(i, n_shards) for i in range(n_shards)])
+            elif n_shards is not None and existing != [n_shards]:
+                raise Exception(f"shard queue {path} has {existing} shards, not {n_shards}: remove it to start over")
+
+        self.n_shards = self.c.execute("SELECT n_shards FROM shard LIMIT 1").fetchone()[0]
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # taking the write lock at once, so that two workers can not lease the same shard
+        with self.lock:
+            self.c.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.c.execute("ROLLBACK")
+                raise
+            self.c.execute("COMMIT")
+
+    def lease(self, owner) -> typing.Optional[int]:
+        now = time.time()
+
+        with self.transaction():
+            r = self.c.execute("""SELECT shard FROM shard
+                                  WHERE state = 'todo' OR (state = 'leased' AND lease_until < ?)
+                                  ORDER BY attempts, shard LIMIT 1""", (now,)).fetchone()
+
+            if r is None:
+                return None
+
+            self.c.execute("UPDATE shard SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 WHERE shard = ?",
+                           (owner, now + self.lease_s, r[0]))
+
+        logger.info("%s leased shard %d of %d", owner, r[0], self.n_shards)
+
+        return r[0]
+
+    def renew(self, shard, owner) -> bool:
+        with self.transaction():
+            return self.c.execute("UPDATE shard SET lease_until = ? WHERE shard = ? AND state = 'leased' AND owner = ?",
+                                  (time.time() + self.lease_s, shard, owner)).rowcount > 0
+
+    def complete(self, shard, owner, facts_fn) -> typing.Optional[int]:
+        # shards left after this one, or None if the lease was lost. The facts of a shard are the same whichever worker
+        # made them, the first to complete it is kept; only the worker completing the last shard is told none are left
+        with self.transaction():
+            if self.c.execute("UPDATE shard SET state = 'done', facts_fn = ? WHERE shard = ? AND state = 'leased' AND owner = ?",
+                              (facts_fn, shard, owner)).rowcount == 0:
+                return None
+
+            return self.c.execute("SELECT COUNT(*) FROM shard WHERE state != 'done'").fetchone()[0]
+
+    def release(self, shard, owner):
+        with self.transaction():
+            self.c.execute("UPDATE shard SET state = 'todo', owner = NULL WHERE shard = ? AND state = 'leased' AND owner = ?",
+                           (shard, owner))
+
+    @contextlib.contextmanager
+    def leased(self, shard, owner):
+        # the lease is renewed while the shard is processed, and given back if processing fails
+        stop = threading.Event()
+
+        def keep_leased():
+            while not stop.wait(self.lease_s / 3):
+                if not self.renew(shard, owner):
+                    logger.warning("%s lost the lease of shard %d", owner, shard)
+
+        renewer = threading.Thread(target=keep_leased, name=f"lease-{shard}", daemon=True)
+        renewer.start()
+
+        try:
+            yield
+        except BaseException:
+            self.release(shard, owner)
+            raise
+        finally:
+            stop.set()
+            renewer.join()
+
+    def progress(self) -> typing.Dict[str, int]:
+        with self.lock:
+            return dict(self.c.execute("SELECT state, COUNT(*) FROM shard GROUP BY state"))
+
+    def done(self) -> bool:
+        return self.progress().get('done', 0) == self.n_shards
+
+    def facts_fns(self) -> typing.List[str]:
+        with self.lock:
+            return [fn for fn, in self.c.execute("SELECT facts_fn FROM shard WHERE state = 'done' ORDER BY shard")]
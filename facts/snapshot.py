@@ -0,0 +1,86 @@
+import logging
+import typing
+import array
+import marshal
+import os
+import rdflib # type: ignore
+import rdflib.util # type: ignore
+
+logger = logging.getLogger()
+
+snapshot_version = 1
+
+
+def snapshot_fn(fn) -> str:
+    return fn + ".snapshot"
+
+
+def source_identity(fn) -> list:
+    st = os.stat(fn)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class SnapshotWriter:
+    # N-Triples rows, with each distinct term stored once and triples as indices into the terms
+
+    def __init__(self):
+        self.terms = {} # type: typing.Dict[str, int]
+        self.triples = array.array('I')
+
+    def term_index(self, term) -> int:
+        i = self.terms.get(term)
+        if i is None:
+            i = self.terms[term] = len(self.terms)
+        return i
+
+    def add_row(self, row):
+        # rows as written by rdflib.plugins.serializers.nt._nt_row: URIs have no spaces, and the object is the rest
+        s, p, o = row[:-3].split(" ", 2)
+        self.triples.extend((self.term_index(s), self.term_index(p), self.term_index(o)))
+
+    def write(self, source_fn):
+        with open(snapshot_fn(source_fn) + ".tmp", "wb") as f:
+            marshal.dump(dict(
+                    version=snapshot_version,
+                    source=source_identity(source_fn),
+                    terms=list(self.terms),
+                    triples=self.triples.tobytes(),
+                ), f)
+
+        os.replace(snapshot_fn(source_fn) + ".tmp", snapshot_fn(source_fn))
+
+        logger.info("snapshot of %s: %d triples, %d terms", source_fn, len(self.triples) // 3, len(self.terms))
+
+
+def load(fn) -> typing.Optional[typing.Tuple[typing.List[str], array.array]]:
+    # snapshot of the file fn, if there is one made from its current content
+    if not os.path.exists(snapshot_fn(fn)):
+        return None
+
+    with open(snapshot_fn(fn), "rb") as f:
+        s = marshal.load(f)
+
+    if s.get('version') != snapshot_version or s['source'] != source_identity(fn):
+        logger.info("snapshot of %s is stale", fn)
+        return None
+
+    triples = array.array('I')
+    triples.frombytes(s['triples'])
+
+    return s['terms'], triples
+
+
+def ntriples_lines(snapshot) -> typing.Generator[str, None, None]:
+    terms, triples = snapshot
+
+    for i in range(0, len(triples), 3):
+        yield f"{terms[triples[i]]} {terms[triples[i+1]]} {terms[triples[i+2]]} .\n"
+
+
+def triples(snapshot) -> typing.Generator[tuple, None, None]:
+    # each distinct term is parsed only once
+    terms, triples = snapshot
+    nodes = [rdflib.util.from_n3(t) for t in terms]
+
+    for i in range(0, len(triples), 3):
+        yield nodes[triples[i]], nodes[triples[i+1]], nodes[triples[i+2]]
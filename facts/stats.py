@@ -0,0 +1,182 @@
+import logging
+import typing
+import bisect
+import cProfile
+import json
+import os
+import threading
+from collections import defaultdict, Counter
+
+logger = logging.getLogger()
+
+# documents kept per workflow for calls over the time budget
+max_timeout_docs = 100
+
+# upper bounds of wall time buckets, in seconds
+time_buckets = [10**(e/4) for e in range(-20, 9)] + [float('inf')]
+
+
+def new_workflow_record() -> dict:
+    return dict(
+        calls=0,
+        cached=0,
+        skipped=0,
+        total_s=0.,
+        max_s=0.,
+        buckets=[0] * len(time_buckets),
+        empty=0,
+        facts=0,
+        exceptions=Counter(),
+        timeouts=0,
+        timeout_docs=[],
+    )
+
+
+class WorkflowStats:
+    # timing and outcome of every workflow call; in worker processes records are collected and merged into the main process
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = defaultdict(new_workflow_record) # type: typing.Dict[str, dict]
+        self.profile_dir = None # type: typing.Optional[str]
+        self.profiles = {} # type: typing.Dict[str, cProfile.Profile]
+        self.profile_lock = threading.Lock()
+
+    def record(self, name, duration_s, outcome, n_facts=0, doc=None):
+        with self.lock:
+            r = self.records[name]
+            r['calls'] += 1
+            r['total_s'] += duration_s
+            r['max_s'] = max(r['max_s'], duration_s)
+            r['buckets'][bisect.bisect_left(time_buckets, duration_s)] += 1
+            r['facts'] += n_facts
+
+            if outcome == 'empty':
+                r['empty'] += 1
+            elif outcome == 'timeout':
+                r['timeouts'] += 1
+                if len(r['timeout_docs']) < max_timeout_docs:
+                    r['timeout_docs'].append(doc)
+            elif outcome != 'found':
+                r['exceptions'][outcome] += 1
+
+    def record_cached(self, name, n_facts=0):
+        with self.lock:
+            self.records[name]['cached'] += 1
+            self.records[name]['facts'] += n_facts
+
+    def record_skipped(self, name):
+        with self.lock:
+            self.records[name]['skipped'] += 1
+
+    def call(self, name, f, *args):
+        if self.profile_dir is None:
+            return f(*args)
+
+        # profiles can not be active in several threads at once, profiled calls are serialized
+        with self.profile_lock:
+            if name not in self.profiles:
+                self.profiles[name] = cProfile.Profile()
+
+            return self.profiles[name].runcall(f, *args)
+
+    def pop(self) -> dict:
+        with self.lock:
+            records, self.records = self.records, defaultdict(new_workflow_record)
+
+        return dict(records)
+
+    def merge(self, records: dict):
+        with self.lock:
+            for name, o in records.items():
+                r = self.records[name]
+                for k in 'calls', 'cached', 'skipped', 'total_s', 'empty', 'facts', 'timeouts':
+                    r[k] += o[k]
+                r['max_s'] = max(r['max_s'], o['max_s'])
+                r['buckets'] = [a + b for a, b in zip(r['buckets'], o['buckets'])]
+                r['exceptions'].update(o['exceptions'])
+                r['timeout_docs'] = (r['timeout_docs'] + o['timeout_docs'])[:max_timeout_docs]
+
+    def quantile_s(self, name, q) -> float:
+        # upper bound of the bucket containing the quantile
+        r = self.records[name]
+        n = sum(r['buckets'])
+        if n == 0:
+            return 0.
+
+        c = 0
+        for le, b in zip(time_buckets, r['buckets']):
+            c += b
+            if c >= q * n:
+                return min(le, r['max_s'])
+
+        return r['max_s']
+
+    def summary(self) -> dict:
+        s = {}
+
+        for name, r in sorted(self.records.items(), key=lambda x: -x[1]['total_s']):
+            s[name] = dict(
+                calls=r['calls'],
+                cached=r['cached'],
+                skipped=r['skipped'],
+                total_s=r['total_s'],
+                mean_s=r['total_s'] / r['calls'] if r['calls'] > 0 else 0.,
+                p95_s=self.quantile_s(name, 0.95),
+                max_s=r['max_s'],
+                empty=r['empty'],
+                facts=r['facts'],
+                exceptions=dict(r['exceptions']),
+                timeouts=r['timeouts'],
+                timeout_docs=list(r['timeout_docs']),
+            )
+
+        return s
+
+    def write_json(self, fn):
+        with open(fn, "w") as f:
+            json.dump(self.summary(), f, indent=4, sort_keys=True)
+
+    def write_prometheus(self, fn):
+        lines = [
+            "# HELP l2f_workflow_duration_seconds wall time of workflow calls",
+            "# TYPE l2f_workflow_duration_seconds histogram",
+        ]
+
+        for name, r in sorted(self.records.items()):
+            c = 0
+            for le, b in zip(time_buckets, r['buckets']):
+                c += b
+                lines.append(f'l2f_workflow_duration_seconds_bucket{{workflow="{name}",le="{"+Inf" if le == float("inf") else "%.6g" % le}"}} {c}')
+            lines.append(f'l2f_workflow_duration_seconds_sum{{workflow="{name}"}} {r["total_s"]}')
+            lines.append(f'l2f_workflow_duration_seconds_count{{workflow="{name}"}} {r["calls"]}')
+
+        for metric, key, help in [
+                    ("l2f_workflow_cached_total", "cached", "workflow outputs taken from the fact cache"),
+                    ("l2f_workflow_skipped_total", "skipped", "workflow calls skipped by the prefilter of the workflow"),
+                    ("l2f_workflow_empty_total", "empty", "workflow calls giving no facts"),
+                    ("l2f_workflow_timeouts_total", "timeouts", "workflow calls over the time budget"),
+                    ("l2f_workflow_facts_total", "facts", "facts produced by the workflow"),
+                ]:
+            lines.append(f"# HELP {metric} {help}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, r in sorted(self.records.items()):
+                lines.append(f'{metric}{{workflow="{name}"}} {r[key]}')
+
+        lines.append("# HELP l2f_workflow_exceptions_total workflow calls failed, by exception type")
+        lines.append("# TYPE l2f_workflow_exceptions_total counter")
+        for name, r in sorted(self.records.items()):
+            for exception, n in sorted(r['exceptions'].items()):
+                lines.append(f'l2f_workflow_exceptions_total{{workflow="{name}",exception="{exception}"}} {n}')
+
+        with open(fn, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def dump_profiles(self):
+        if self.profile_dir is None:
+            return
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+
+        for name, p in self.profiles.items():
+            p.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
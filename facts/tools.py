@@ -1,8 +1,13 @@
 import time
+import glob
+import os
+import typing
+from concurrent import futures
 import click
 
 import facts.gcn
 import facts.arxiv
+import facts.atel
 import facts.learn
 
 @click.group()
@@ -10,47 +15,125 @@ def cli():
     pass
 
 
+def outputs_fingerprint(t) -> typing.Optional[tuple]:
+    # tasks without declared outputs always count as producing something new
+    if len(t.get('outputs', [])) == 0:
+        return None
+
+    return tuple(sorted((fn, os.stat(fn).st_size, os.stat(fn).st_mtime_ns)
+                        for pattern in t['outputs'] for fn in glob.glob(pattern)))
+
+
+def task_due(t, tasks_by_name, now) -> bool:
+    if now < t['retry_at']:
+        return False
+
+    age = now - t['last']
+
+    if age >= t['period_s']:
+        return True
+
+    # downstream tasks run as soon as any upstream task produced something new since their last run
+    return any(tasks_by_name[u]['changed_at'] > t['last'] for u in t.get('after', []))
+
+
+def task_ready(t, tasks_by_name, running, settled, now) -> bool:
+    # upstream tasks which are running or due are waited for, unless they are settled for this round.
+    # a task does not start while a task which runs after it is running: learn reads what the fetches write
+    if any(t['name'] in d.get('after', []) for name, d in tasks_by_name.items() if name in running):
+        return False
+
+    return all(u not in running and (u in settled or not task_due(tasks_by_name[u], tasks_by_name, now))
+               for u in t.get('after', []))
+
+
+def run_task(t):
+    before = outputs_fingerprint(t)
+    t['f']()
+    return before is None or outputs_fingerprint(t) != before
+
+
+def schedule(tasks, one_shot=False, max_workers=4, tick_s=10, backoff_s=13, max_backoff_s=3600):
+    for t in tasks:
+        t.setdefault('last', 0)
+        t.setdefault('changed_at', 0)
+        t.setdefault('failures', 0)
+        t.setdefault('retry_at', 0)
+
+    tasks_by_name = {t['name']: t for t in tasks}
+    running = {} # type: typing.Dict[str, futures.Future]
+    ran = set()
+
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
+        while True:
+            now = time.time()
+
+            for t in tasks:
+                if t['name'] in running or (one_shot and t['name'] in ran):
+                    continue
+
+                if task_due(t, tasks_by_name, now) and task_ready(t, tasks_by_name, running, ran if one_shot else set(), now):
+                    print(f"{t['name']}: starting, last run {now - t['last']:.0f} s ago, period {t['period_s']}")
+                    t['started'] = now
+                    running[t['name']] = ex.submit(run_task, t)
+                    ran.add(t['name'])
+
+            if len(running) == 0:
+                if one_shot:
+                    break
+
+                time.sleep(tick_s)
+                continue
+
+            done, _ = futures.wait(list(running.values()), timeout=tick_s, return_when=futures.FIRST_COMPLETED)
+
+            for name, f in list(running.items()):
+                if f not in done:
+                    continue
+
+                running.pop(name)
+                t = tasks_by_name[name]
+
+                try:
+                    changed = f.result()
+                except Exception as e:
+                    t['failures'] += 1
+                    delay_s = min(max_backoff_s, backoff_s * 2**(t['failures'] - 1))
+                    t['retry_at'] = time.time() + delay_s
+                    print(f"{name}: failed {t['failures']} times in a row: {repr(e)}, retrying in {delay_s} s")
+                    continue
+
+                t['failures'] = 0
+                t['last'] = t['started']
+
+                if changed:
+                    t['changed_at'] = time.time()
+                    print(f"{name}: done in {time.time() - t['started']:.0f} s")
+                else:
+                    print(f"{name}: done in {time.time() - t['started']:.0f} s, nothing new")
+
+
 @cli.command()
 @click.option("-1", "--one-shot", is_flag=True)
 @click.pass_context
 def daily(ctx, one_shot):
+    # fetches run concurrently; learn runs after them, and only if they brought something new, or at least every period_s
     tasks = [
-            {'name':'gcn.fetch_tar', 'f': lambda:ctx.invoke(facts.gcn.fetch_tar), 'period_s': 3600*8, 'last': 0},
-            {'name':'arxiv.fetch', 'f': lambda:ctx.invoke(facts.arxiv.fetch, max_results=200), 'period_s': 3600*8, 'last': 0},
-            {'name':'atel.fetch', 'f': lambda:ctx.invoke(facts.atel.fetch), 'period_s': 3600, 'last': 0},
-            {'name':'learn', 'f': lambda:ctx.invoke(facts.learn.learn, gcn=True, arxiv=True, atel=True), 'period_s': 1800, 'last': 0},
-            {'name':'publish', 'f': lambda:ctx.invoke(facts.learn.publish), 'period_s': 3600, 'last': 0},
+            {'name':'gcn.fetch_tar', 'f': lambda:ctx.invoke(facts.gcn.fetch_tar), 'period_s': 3600*8,
+             'outputs': [facts.gcn.gcn_archive_fn]},
+            {'name':'gcn.fetch_recent', 'f': lambda:ctx.invoke(facts.gcn.fetch_recent), 'period_s': 1800,
+             'outputs': [facts.gcn.gcn_recent_fn]},
+            {'name':'arxiv.fetch', 'f': lambda:ctx.invoke(facts.arxiv.fetch, max_results=200), 'period_s': 3600*8,
+             'outputs': [facts.arxiv.paper_store_fn]},
+            {'name':'atel.fetch', 'f': lambda:ctx.invoke(facts.atel.fetch), 'period_s': 3600,
+             'outputs': [facts.atel.atel_store_fn]},
+            {'name':'learn', 'f': lambda:ctx.invoke(facts.learn.learn, gcn=True, arxiv=True, atel=True, fact_cache="facts-cache.sqlite", views="facts-views.sqlite"), 'period_s': 1800,
+             'after': ['gcn.fetch_tar', 'gcn.fetch_recent', 'arxiv.fetch', 'atel.fetch'], 'outputs': ["knowledge.n3"]},
+            {'name':'publish', 'f': lambda:ctx.invoke(facts.learn.publish), 'period_s': 3600,
+             'after': ['learn']},
         ]
 
-    failures = []
-    sleep_s_on_failure = 13
-
-    while True:
-        sleep_seconds = 301
-
-        now = time.time()
-        for t in tasks:
-            age = now - t['last']
-            if age < t['period_s']:
-                print(f"{t['name']}: age {age} < period {t['period_s']}: too early, will run in {t['period_s'] - age}")
-            else:
-                print(f"{t['name']}: age {age} > period {t['period_s']}: time to run, overdue by {-t['period_s'] +age}")
-                try:
-                    t['f']()
-                    t['last'] = now
-                except Exception as e:
-                    failures.append(dict(
-                        exception=e,
-                        time=time.time(),
-                    ))
-                    time.sleep(sleep_s_on_failure)
-                    
-
-        if one_shot:
-            break
-
-        print(f"sleeping.... {sleep_seconds} from {time.strftime('%Y-%m-%d %H:%M:%S')}")
-        time.sleep(sleep_seconds)
+    schedule(tasks, one_shot=one_shot)
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,222 @@
+import logging
+import typing
+import json
+import os
+import sqlite3
+from collections import defaultdict
+import rdflib # type: ignore
+from facts import snapshot
+
+logger = logging.getLogger()
+
+paper_ns = "http://odahub.io/ontology/paper#"
+
+# predicates of circulars reporting an event, which other circulars refer to as counterparts
+event_report_predicates = [paper_ns + "lvc_event_report", paper_ns + "reports_icecube_event"]
+grb_report_predicate = paper_ns + "integral_grb_report"
+
+
+class ReactionViews:
+    # reaction time summaries of `learn contemplate`, kept per event and updated for the events each changed document touches.
+    # facts of every document are kept with their terms indexed, so that only the joins for these events are redone
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = [] # type: typing.List[typing.Tuple[str, list]]
+
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.c = sqlite3.connect(path, timeout=60)
+        self.c.execute("PRAGMA journal_mode=WAL")
+        self.c.executescript("""
+            CREATE TABLE IF NOT EXISTS doc_fact (
+                doc TEXT,
+                predicate TEXT,
+                term TEXT,
+                value TEXT,
+                PRIMARY KEY (doc, predicate, term)
+            );
+            CREATE INDEX IF NOT EXISTS doc_fact_term ON doc_fact (term, predicate);
+            CREATE TABLE IF NOT EXISTS event_summary (
+                kind TEXT,
+                event TEXT,
+                summary TEXT,
+                PRIMARY KEY (kind, event)
+            );
+            CREATE TABLE IF NOT EXISTS source (
+                fn TEXT PRIMARY KEY,
+                identity TEXT
+            );
+        """)
+        self.c.commit()
+
+    def n_documents(self) -> int:
+        return self.c.execute("SELECT COUNT(DISTINCT doc) FROM doc_fact").fetchone()[0]
+
+    def record_source(self, fn):
+        # the views hold the facts of fn as of its size and modification time, as the snapshot does
+        with self.c:
+            self.c.execute("INSERT OR REPLACE INTO source VALUES (?, ?)", (fn, json.dumps(snapshot.source_identity(fn))))
+
+    def source_matches(self, fn) -> bool:
+        r = self.c.execute("SELECT identity FROM source WHERE fn=?", (fn,)).fetchone()
+        return r is not None and json.loads(r[0]) == snapshot.source_identity(fn)
+
+    def touched_events(self, doc) -> typing.Tuple[typing.Set[str], typing.Set[str]]:
+        marks = ",".join("?" * len(event_report_predicates))
+
+        events = set(t for t, in self.c.execute(
+                        f"SELECT term FROM doc_fact WHERE doc=? AND predicate IN ({marks})", [doc] + event_report_predicates))
+
+        # counterparts are joined with the event on any predicate
+        events.update(t for t, in self.c.execute(
+                        f"""SELECT DISTINCT e.term FROM doc_fact d JOIN doc_fact e ON e.term = d.term
+                            WHERE d.doc=? AND e.predicate IN ({marks})""", [doc] + event_report_predicates))
+
+        grbs = set(t for t, in self.c.execute(
+                        "SELECT term FROM doc_fact WHERE doc=? AND predicate=?", (doc, grb_report_predicate)))
+
+        return events, grbs
+
+    def _update_document(self, doc, triples) -> typing.Tuple[typing.Set[str], typing.Set[str]]:
+        # a document with the same facts as before touches no events
+        rows = {}
+        for s, p, o in triples:
+            rows.setdefault((str(p), o.n3()), str(o))
+
+        if rows == {(p, t): v for p, t, v in self.c.execute("SELECT predicate, term, value FROM doc_fact WHERE doc=?", (doc,))}:
+            return set(), set()
+
+        events, grbs = self.touched_events(doc)
+
+        self.c.execute("DELETE FROM doc_fact WHERE doc=?", (doc,))
+        self.c.executemany("INSERT INTO doc_fact VALUES (?, ?, ?, ?)",
+                           [(doc, p, t, v) for (p, t), v in rows.items()])
+
+        new_events, new_grbs = self.touched_events(doc)
+
+        return events | new_events, grbs | new_grbs
+
+    def update_documents(self, documents: typing.Iterable[typing.Tuple[str, list]]) -> int:
+        # documents are (id, all triples of the document), the previous facts of the document are replaced
+        events, grbs = set(), set() # type: typing.Set[str], typing.Set[str]
+
+        with self.c:
+            for doc, triples in documents:
+                e, g = self._update_document(doc, triples)
+                events |= e
+                grbs |= g
+
+            for event in events:
+                self.update_counterpart_summary(event)
+
+            for grb in grbs:
+                self.update_grb_summary(grb)
+
+        logger.debug("updated views of %d events and %d grbs", len(events), len(grbs))
+
+        return len(events) + len(grbs)
+
+    def update_document(self, doc, triples) -> int:
+        return self.update_documents([(doc, triples)])
+
+    def add_document(self, doc, triples):
+        # documents are updated in batches, each in one transaction; flush() updates the rest
+        self.pending.append((doc, list(triples)))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        pending, self.pending = self.pending, []
+
+        if len(pending) == 0:
+            return 0
+
+        return self.update_documents(pending)
+
+    def store_summary(self, kind, event, summary):
+        if summary is None:
+            self.c.execute("DELETE FROM event_summary WHERE kind=? AND event=?", (kind, event))
+        else:
+            self.c.execute("INSERT OR REPLACE INTO event_summary VALUES (?, ?, ?)", (kind, event, json.dumps(summary)))
+
+    def update_counterpart_summary(self, event):
+        summary = None
+
+        for predicate in event_report_predicates:
+            for event_value, event_date, counterpart_date, t0, instrument in self.c.execute("""
+                        SELECT ev.value, ev_d.value, ct_d.value, t0.value, instr.value
+                        FROM doc_fact ev
+                            JOIN doc_fact ev_d ON ev_d.doc = ev.doc AND ev_d.predicate = :date
+                            JOIN doc_fact ct ON ct.term = ev.term
+                            JOIN doc_fact ct_d ON ct_d.doc = ct.doc AND ct_d.predicate = :date
+                            JOIN doc_fact t0 ON t0.doc = ct.doc AND t0.predicate = :t0
+                            JOIN doc_fact instr ON instr.doc = ct.doc AND instr.predicate = :instrument
+                        WHERE ev.term = :event AND ev.predicate = :report AND ev_d.term != ct_d.term
+                        ORDER BY ev.doc, ev_d.term, ct.doc, ct.predicate, ct_d.term, t0.term, instr.term
+                    """, dict(event=event, report=predicate, date=paper_ns + "DATE",
+                              t0=paper_ns + "original_event_utc", instrument=paper_ns + "instrument")):
+
+                if summary is None:
+                    summary = dict(
+                        event=event_value,
+                        event_gcn_time=event_date,
+                        counterpart_gcn_time=counterpart_date,
+                        event_t0=t0,
+                        instrument=[],
+                    )
+
+                summary['instrument'].append(instrument)
+
+        self.store_summary('counterpart', event, summary)
+
+    def update_grb_summary(self, grb):
+        summary = [
+                dict(event=grb_value, event_t0=t0, event_gcn_time=gcn_date)
+                for grb_value, t0, gcn_date in self.c.execute("""
+                        SELECT r.value, t0.value, d.value
+                        FROM doc_fact r
+                            JOIN doc_fact d ON d.doc = r.doc AND d.predicate = :date
+                            JOIN doc_fact t0 ON t0.doc = r.doc AND t0.predicate = :t0
+                        WHERE r.term = :grb AND r.predicate = :report AND t0.term != d.term
+                        ORDER BY r.doc, t0.term, d.term
+                    """, dict(grb=grb, report=grb_report_predicate, date=paper_ns + "DATE", t0=paper_ns + "event_t0"))
+            ]
+
+        self.store_summary('grb', grb, summary if len(summary) > 0 else None)
+
+    def summaries(self, kind) -> list:
+        return [json.loads(s) for s, in self.c.execute("SELECT summary FROM event_summary WHERE kind=? ORDER BY event", (kind,))]
+
+    def counterpart_summary(self) -> list:
+        return self.summaries('counterpart')
+
+    def grb_summary(self) -> list:
+        return [r for s in self.summaries('grb') for r in s]
+
+    def load_graph_file(self, fn, format="n3"):
+        snap = snapshot.load(fn)
+
+        if snap is not None:
+            triples = snapshot.triples(snap)
+        else:
+            triples = rdflib.Graph().parse(fn, format=format)
+
+        by_doc = defaultdict(list)
+        n = 0
+        for s, p, o in triples:
+            by_doc[str(s).split("#")[-1]].append((s, p, o))
+            n += 1
+
+        logger.info(f"loaded {n} facts from {fn}")
+
+        self.c.execute("DELETE FROM doc_fact")
+        self.c.execute("DELETE FROM event_summary")
+
+        n_updated = self.update_documents(by_doc.items())
+        self.record_source(fn)
+
+        return n_updated
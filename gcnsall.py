@@ -4,21 +4,22 @@ import requests
 import logging
 import os
 
-from facts.core import workflow
+from facts.core import workflow, DocumentHandle
 import facts.core
-from facts.gcn import GCNText, NoSuchGCN, gcn_source
+from facts import fetch
+from facts.gcn import GCNText, NoSuchGCN, gcn_source, gcn_handles
 
 logger = logging.getLogger(__name__)
 
 
 @workflow
-def gcn_list_all() -> typing.List[GCNText]:
+def gcn_list_all(shard=None) -> typing.List[GCNText]:
 
     from_gcn = int(os.environ.get("FROM_GCN", 27000))
     to_gcn = os.environ.get("TO_GCN", None)
 
     if to_gcn is None:
-        gt = requests.get("https://gcn.gsfc.nasa.gov/gcn3_archive.html").text
+        gt = fetch.cached_get("https://gcn.gsfc.nasa.gov/gcn3_archive.html", ttl_s=600).text
 
         r = map(int, re.findall(r"<A HREF=gcn3/\d{1,5}.gcn3>(\d{1,5})</A>", gt))
         
@@ -29,15 +30,9 @@ def gcn_list_all() -> typing.List[GCNText]:
     else:
         to_gcn = int(to_gcn)
 
-    for i in reversed(range(from_gcn, to_gcn)):
-        logger.debug(f"gcn: {i}")
+    yield from gcn_handles(reversed(range(from_gcn, to_gcn)), shard)
 
-        try:
-            yield gcn_source(i)
-        except NoSuchGCN:
-            logger.warning(f"no GCN: {i}")
 
 
 
-
-facts.core.workflow_context = [w for w in facts.core.workflow_context if w['name'] != 'gcn_list_recent' ]
+facts.core.remove_workflow('gcn_list_recent')
@@ -0,0 +1,58 @@
+import logging
+import typing
+
+import pytest
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+sample_gcn_text = """TITLE:   GCN CIRCULAR
+NUMBER:  31373
+SUBJECT: GRB 220101A: INTEGRAL SPI-ACS detection of the afterglow
+DATE:    22/01/02 10:11:12 GMT
+FROM:    Someone at Somewhere <some@one.org>
+
+A. Author (Inst), B. Author (Inst)
+and C. Author report on behalf of the team:
+
+The GRB 220101A afterglow was clearly detected, see GCN Circ. 31347 and GCN 31350.
+INTEGRAL and IceCube-211125A and IC211125A are mentioned.
+We find a limiting fluence of 1.2e-7 erg/cm2 for 1 s.
+"""
+
+
+@pytest.fixture
+def sample_gcn() -> str:
+    return sample_gcn_text
+
+
+@pytest.fixture
+def gcn_entry(sample_gcn):
+    import facts.gcn as g
+
+    def entry(text=sample_gcn):
+        return dict(arg=g.GCNText(text), arg_type=g.GCNText)
+
+    return entry
+
+
+@pytest.fixture
+def gcn_inputs(monkeypatch, sample_gcn):
+    # circulars found by learn come from the given generator instead of the recent ones,
+    # by default n copies of the sample numbered from 31373
+    import facts.core as c
+    import facts.gcn as g
+
+    def use(n=None, generator=None):
+        if generator is None:
+            def gcn_list_sample() -> typing.Generator[g.GCNText, None, None]:
+                for i in range(n):
+                    yield g.GCNText(sample_gcn.replace("31373", str(31373 + i)))
+
+            generator = gcn_list_sample
+
+        monkeypatch.setattr(c, 'workflow_context',
+                            [w for w in c.workflow_context if w['name'] != 'gcn_list_recent'] +
+                            [dict(name=generator.__name__, function=generator, signature=generator.__annotations__)])
+
+    return use
@@ -0,0 +1,90 @@
+import os
+
+
+
+def test_arxiv_paper_store(tmp_path):
+    import facts.arxiv
+
+    fn = str(tmp_path / "arxiv-papers.json")
+
+    def entry(i, v):
+        return dict(id=f"http://arxiv.org/abs/2101.{i:05d}v{v}", title=f"paper {i}", summary="GRB and FRB and INTEGRAL",
+                    updated="2021-01-01T00:00:00Z", authors=[dict(name="A. Person")], links=[], title_detail={})
+
+    # same papers in feeds sorted by different fields
+    by_updated = [entry(i, 1) for i in range(10)]
+    by_submitted = [entry(i, 1) for i in range(5, 15)]
+
+    assert facts.arxiv.merge_papers(by_updated + by_submitted, fn) == 15
+    mtime = os.stat(fn).st_mtime_ns
+
+    assert facts.arxiv.merge_papers(by_submitted, fn) == 0
+    assert os.stat(fn).st_mtime_ns == mtime
+
+    assert facts.arxiv.merge_papers([entry(3, 2)], fn) == 1
+
+    papers = facts.arxiv.load_papers(fn)
+    assert len(papers) == 16
+    assert set(papers["2101.00003v2"]) == set(facts.arxiv.paper_fields)
+
+
+def test_arxiv_harvest_stops_at_known(monkeypatch, tmp_path):
+    import http.server
+    import threading
+    import urllib.parse
+    import facts.arxiv
+
+    papers = [f"2101.{i:05d}v1" for i in reversed(range(1000))]
+    pages_served = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            q = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+            start, n = int(q['start']), int(q['max_results'])
+            pages_served.append(start)
+
+            entries = "".join(f"""<entry><id>http://arxiv.org/abs/{p}</id><updated>2021-01-01T00:00:00Z</updated>
+                                  <title>paper {p}</title><summary>about GRB</summary></entry>"""
+                              for p in papers[start:start + n])
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/atom+xml')
+            self.end_headers()
+            self.wfile.write(f'<feed xmlns="http://www.w3.org/2005/Atom">{entries}</feed>'.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setenv("L2F_HTTP_STANDIN", f"http://export.arxiv.org=http://127.0.0.1:{server.server_port}")
+    monkeypatch.setitem(facts.fetch.min_interval_s, f"127.0.0.1:{server.server_port}", 0.)
+
+    try:
+        known = set(papers[250:])
+        entries = facts.arxiv.harvest("cat:astro-ph", "submittedDate", known, max_results=2000, page_size=100)
+        assert pages_served == [0, 100, 200]
+        assert len([e for e in entries if facts.arxiv.paper_key(e) not in known]) == 250
+
+        pages_served.clear()
+        entries = facts.arxiv.harvest("cat:astro-ph", "submittedDate", set(), max_results=150, page_size=100)
+        assert pages_served == [0, 100]
+        assert len(entries) == 150
+    finally:
+        server.shutdown()
+
+    # a failed query does not lose what the others harvested
+    from click.testing import CliRunner
+
+    def harvest(search_query, sortBy, known, max_results, page_size):
+        if sortBy == "submittedDate":
+            raise RuntimeError("unavailable")
+        return [dict(id="http://arxiv.org/abs/2101.00001v1", title="paper", summary="GRB", updated="2021-01-01T00:00:00Z")]
+
+    monkeypatch.setattr(facts.arxiv, 'harvest', harvest)
+    monkeypatch.chdir(tmp_path)
+
+    r = CliRunner().invoke(facts.arxiv.cli, ["fetch", "-c", "astro-ph.HE"])
+    assert isinstance(r.exception, RuntimeError)
+    assert list(facts.arxiv.load_papers()) == ["2101.00001v1"]
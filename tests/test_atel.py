@@ -0,0 +1,73 @@
+import os
+
+
+
+def test_atel_store(tmp_path):
+    import facts.atel
+
+    def atel_email(i, body):
+        fn = tmp_path / f"{i}.txt"
+        fn.write_text(f"""Subject: [ATEL #{i}] test\n\nATEL #{i}; Title: Radio bursts from SGR 1935+2154
+Author: A. Person (Somewhere); B. Person
+Queries: a.person@example.org
+Posted: 1 Nov 2021; 10:00 UT
+Subjects: Radio, FRB, Magnetar
+
+{body}
+--------------------------------------------------
+""")
+        return str(fn)
+
+    fns = [atel_email(i, f"We observed FRB 200428 with INTEGRAL, report {i}.") for i in range(15050, 15060)]
+    (tmp_path / "broken.txt").write_text("not an email")
+    fns.append(str(tmp_path / "broken.txt"))
+
+    store = facts.atel.ATelStore(str(tmp_path / "atels.jsonl"))
+    assert store.ingest(fns) == 10
+    assert store.get(15055)['body'].startswith("We observed FRB 200428")
+    assert [int(e['atelid']) for e in store] == list(range(15050, 15060))
+
+    # a new store reads what was saved, and parses only changed emails
+    store = facts.atel.ATelStore(str(tmp_path / "atels.jsonl"))
+    assert store.ingest(fns) == 0
+
+    atel_email(15055, "Updated report of FRB 200428.")
+    os.utime(fns[5], ns=(0, 1))
+    assert store.ingest(fns) == 1
+
+    store = facts.atel.ATelStore(str(tmp_path / "atels.jsonl"))
+    assert store.get(15055)['body'].startswith("Updated report")
+    assert len(list(store)) == 10
+    assert [e['body'] for e in store if e['atelid'] == "15055"] == [store.get(15055)['body']]
+
+
+def test_atel_list_entries_sources(tmp_path, monkeypatch):
+    import json
+    import facts.atel
+    import facts.core
+
+    monkeypatch.chdir(tmp_path)
+    facts.atel.atel_store.cache_clear()
+
+    def web_entry(i):
+        return dict(atelid=str(i), url=f"https://www.astronomerstelegram.org/?read={i}", title=f"web {i}", authors="A. Person", date="1 Nov 2021; 10:00 UT")
+
+    # only atels.json, written by fetch-web or parse-html
+    json.dump([web_entry(15050), web_entry(15061)], open("atels.json", "w"))
+    assert [e['atelid'] for e in facts.atel.list_entries()] == ["15050", "15061"]
+
+    # with the store, ATels in both are taken from the store, the others from atels.json
+    open(facts.atel.atel_store_fn, "w").write(json.dumps(dict(web_entry(15050), title="email 15050")) + "\n")
+    store = facts.atel.ATelStore(facts.atel.atel_store_fn)
+    store.index[15050] = [0, os.path.getsize(facts.atel.atel_store_fn)]
+    store.save()
+    facts.atel.atel_store.cache_clear()
+
+    try:
+        assert [(e['atelid'], e['title']) for e in facts.atel.list_entries()] == [("15050", "email 15050"), ("15061", "web 15061")]
+
+        sharded = [e.load() if isinstance(e, facts.core.DocumentHandle) else e
+                   for i in range(3) for e in facts.atel.list_entries(shard=(i, 3))]
+        assert sorted(e['title'] for e in sharded) == ["email 15050", "web 15061"]
+    finally:
+        facts.atel.atel_store.cache_clear()
@@ -0,0 +1,17 @@
+def test_bench(tmp_path):
+    import facts.bench
+
+    docs = facts.bench.corpus(n_gcn=12, n_atel=3, n_arxiv=3)
+    assert docs == facts.bench.corpus(n_gcn=12, n_atel=3, n_arxiv=3), "corpus should be reproducible"
+
+    metrics = facts.bench.run_benchmarks(docs, repeat=1, min_s=0)
+
+    assert {"pipeline.GCNText.docs_per_s", "pipeline.ATelEntry.docs_per_s", "pipeline.PaperEntry.docs_per_s",
+            "graph.build.facts_per_s", "graph.serialize_n3.facts_per_s", "workflow.facts.gcn.gcn_lvc_event.calls_per_s"} <= set(metrics)
+
+    baseline = dict(metrics)
+    assert facts.bench.compare(metrics, baseline) == []
+
+    baseline["pipeline.GCNText.docs_per_s"] *= 2
+    baseline["workflow.facts.gcn.gcn_lvc_event.calls_per_s"] *= 1.5
+    assert [r.split(":")[0] for r in facts.bench.compare(metrics, baseline)] == ["pipeline.GCNText.docs_per_s"]
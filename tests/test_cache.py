@@ -0,0 +1,50 @@
+def test_fact_cache(monkeypatch, tmp_path, sample_gcn, gcn_entry):
+    import facts.core as c
+    import facts.cache
+
+    monkeypatch.setattr(c, 'fact_cache', facts.cache.FactCache(str(tmp_path / "facts.sqlite")))
+
+    c_id, triples = c.workflows_for_input(gcn_entry(), output='triples')
+
+    cached = c.fact_cache.lookup(f"http://odahub.io/ontology/paper#{c_id}", facts.cache.input_hash(sample_gcn))
+    assert 'mentions_keyword' in cached
+
+    c_id_cached, triples_cached = c.workflows_for_input(gcn_entry(), output='triples')
+    assert triples_cached == triples
+
+    changed_gcn = sample_gcn.replace("1.2e-7", "3.4e-7")
+    assert c.fact_cache.lookup(f"http://odahub.io/ontology/paper#{c_id}", facts.cache.input_hash(changed_gcn)) == {}
+
+    c_id_changed, triples_changed = c.workflows_for_input(gcn_entry(changed_gcn), output='triples')
+    assert c.fact_cache.lookup(f"http://odahub.io/ontology/paper#{c_id}", facts.cache.input_hash(changed_gcn)) != {}
+    assert triples_changed != triples
+
+
+def test_fact_cache_lossless(monkeypatch, tmp_path, gcn_entry):
+    import facts.core as c
+    import facts.cache
+    import facts.gcn as g
+
+    @c.workflow
+    def _structured(gcntext: g.GCNText):
+        return {'pair': ("GRB", 1.5), 'values': [1, 2.5e-7, "x"]}
+
+    try:
+        fresh = c.workflows_for_input(gcn_entry(), output='triples')
+
+        monkeypatch.setattr(c, 'fact_cache', facts.cache.FactCache(str(tmp_path / "facts.sqlite")))
+
+        stored = c.workflows_for_input(gcn_entry(), output='triples')
+        cached = c.workflows_for_input(gcn_entry(), output='triples')
+
+        assert c.workflow_stats.summary()[_structured.__module__ + '._structured']['cached'] >= 1
+        assert stored == fresh
+        assert cached == fresh
+    finally:
+        c.remove_workflow('_structured')
+
+    v = facts.cache.workflow_version(g.mentions_keyword)
+    monkeypatch.setattr(facts.cache, 'CACHE_SCHEMA', facts.cache.CACHE_SCHEMA + 1)
+    facts.cache.workflow_version.cache_clear()
+    assert facts.cache.workflow_version(g.mentions_keyword) != v
+    facts.cache.workflow_version.cache_clear()
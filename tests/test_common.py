@@ -0,0 +1,14 @@
+def test_keyword_matcher():
+    from facts import common
+
+    n = common.count_keywords("SGRB and GRB, ISGRI, INTEGRAL LIGO/Virgo", tuple(common.relevant_keywords()))
+    assert n == {"SGR": 2, "GRB": 2, "ISGRI": 1, "INTEGRAL": 1, "LIGO/Virgo": 1}
+
+    d = common.mentions_keyword("GRB 220101A", "GRB GRB SGRB")
+    assert d['mentions_grb'] == "title"
+    assert d['mentions_grb_times'] == 3
+    assert d['mentions_sgr'] == "body"
+
+    d = common.mentions_grblike("", "IceCube-211125A, IC211125A, AT 2022cmc and ZTF22aaajecb")
+    assert d['mentions_named_event'] == ['IceCube-211125A', 'IC211125A', 'AT2022cmc', 'ZTF22aaajecb']
+    assert d['mentions_named_ztf'] == ['ZTF22aaajecb']
@@ -0,0 +1,210 @@
+import pytest
+import rdflib # type: ignore
+
+
+def test_facts_graph_same_as_sparql_insert(gcn_entry):
+    import facts.core as c
+
+    c_id, triples = c.workflows_for_input(gcn_entry(), output='triples')
+
+    assert c_id == 'gcn31373'
+
+    G_sparql = rdflib.Graph()
+    for fact in triples:
+        G_sparql.update(f'INSERT DATA {{ {c.fact_n3(fact)} }}')
+
+    G = c.facts_graph(triples)
+
+    assert set(G) == set(G_sparql)
+    assert (rdflib.URIRef('http://odahub.io/ontology/paper#gcn31373'),
+            rdflib.URIRef('http://odahub.io/ontology/paper#integral_ul'),
+            rdflib.Literal(1.2e-7)) in G
+
+
+def test_document_facts(gcn_entry):
+    import pickle
+    from rdflib.plugins.serializers import nt
+    import facts.core as c
+
+    for v in ["plain", 'q"u\\o\nte\r', "ünï", "", 0, -12, 2**70, 1.2e-7, -0.0, 3.0, 1e300, float('nan'), float('inf'), True]:
+        assert c.literal_nt(v) == nt._quoteLiteral(rdflib.Literal(v))
+
+    c_id, triples = c.workflows_for_input(gcn_entry(), output='triples')
+
+    assert isinstance(triples, c.DocumentFacts)
+    assert triples.ntriples_rows() == [nt._nt_row(t) for t in triples]
+    assert pickle.loads(pickle.dumps(triples)) == triples
+    assert c.workflows_for_input(gcn_entry(), output='dict')['paper:integral_ul'] == 1.2e-7
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_stream_ntriples(executor, gcn_inputs):
+    import io
+    import facts.core as c
+    import facts.gcn as g
+
+    gcn_inputs(5)
+
+    f = io.StringIO()
+    n = c.write_ntriples(c.stream_workflows_by_input(2, input_types=[g.GCNText], max_inputs=4, 
+                                                     executor=executor, modules=["facts.gcn"]), f)
+
+    G = rdflib.Graph()
+    G.parse(data=f.getvalue(), format='nt')
+
+    assert len(G) == n
+    assert set(G.subjects()) == {rdflib.URIRef(f'http://odahub.io/ontology/paper#gcn{31373 + i}') for i in range(4)}
+
+
+def test_document_handle(sample_gcn):
+    import facts.core as c
+    import facts.gcn as g
+
+    c_id, triples = c.workflows_for_input(dict(arg=c.DocumentHandle("facts.gcn:GCNText", sample_gcn), arg_type=g.GCNText), 
+                                          output='triples')
+    assert c_id == 'gcn31373'
+    assert len(triples) > 0
+
+    c_id, triples = c.workflows_for_input(dict(arg=c.DocumentHandle("facts.gcn:no_such_loader", 1), arg_type=g.GCNText), 
+                                          output='triples')
+    assert triples == []
+
+
+def test_workflow_registry():
+    import facts.core as c
+    import facts.gcn as g
+
+    names = [w['name'] for w in c.workflows_by_type[g.GCNText]]
+
+    assert 'mentions_keyword' in names
+    assert 'gcn_source' not in names
+    assert c.identity_by_type[g.GCNText] is g.identity
+
+
+def test_derived_view_computed_once_per_input(monkeypatch, sample_gcn, gcn_entry):
+    import facts.core as c
+    import facts.gcn as g
+
+    calls = []
+    normalize = g.gcn_text_normalized.__wrapped__
+
+    @c.derived_view
+    def counting_normalized(gcntext):
+        calls.append(1)
+        return normalize(gcntext)
+
+    monkeypatch.setattr(g, 'gcn_text_normalized', counting_normalized)
+
+    c.workflows_for_input(gcn_entry(), output='triples')
+    assert len(calls) == 1
+
+    assert g.gcn_header(sample_gcn)['SUBJECT'] == "GRB 220101A: INTEGRAL SPI-ACS detection of the afterglow"
+    assert g.gcn_text_normalized("a \n\r b") == "a b"
+
+    # the views of an input are dropped even if processing it is interrupted
+    def interrupted(gcntext):
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(g, 'gcn_text_normalized', interrupted)
+
+    with pytest.raises(KeyboardInterrupt):
+        c.workflows_for_input(gcn_entry(), output='triples')
+    assert c.input_views.memo is None
+
+
+def test_staged_evaluation(sample_gcn, gcn_entry):
+    import typing
+    import facts.core as c
+    import facts.gcn as g
+
+    c.workflow_stats.pop()
+    assert c.workflows_for_input(gcn_entry("NUMBER: 1\nSUBJECT: nothing of interest\n"), output='list')[1] == []
+
+    summary = c.workflow_stats.summary()
+    assert summary['facts.gcn.mentions_keyword']['calls'] == 1
+    assert 'facts.gcn.fermi_v2' not in summary
+
+    @c.workflow
+    @c.relevance
+    def _boring_check(gcntext: g.GCNText):
+        if "boring" in gcntext:
+            raise g.BoringGCN()
+        return {}
+
+    try:
+        assert c.workflows_for_input(gcn_entry(), output='list')[1] != []
+
+        c.workflow_stats.pop()
+        assert c.workflows_for_input(gcn_entry(sample_gcn + "\nboring\n"), output='list')[1] == []
+        summary = c.workflow_stats.summary()
+        assert summary[_boring_check.__module__ + '._boring_check']['exceptions'] == {'BoringGCN': 1}
+        assert 'facts.gcn.gcn_meta' not in summary
+    finally:
+        c.remove_workflow('_boring_check')
+
+    # an input type without relevance workflows, as a plugin loaded with -m may have, is not dropped before they run
+    NoteText = typing.NewType("NoteText", str)
+
+    @c.workflow
+    def _note_mentions(note: NoteText):
+        return {'mentions_note': "body"}
+
+    try:
+        c_id, facts = c.workflows_for_input(dict(arg=NoteText("a note"), arg_type=NoteText), output='list')
+        assert len(facts) == 1
+    finally:
+        c.remove_workflow('_note_mentions')
+
+
+def test_workflow_time_budget(monkeypatch, sample_gcn, gcn_entry):
+    import re
+    import time
+    from concurrent import futures
+    import facts.core as c
+    import facts.gcn as g
+
+    @c.workflow
+    @c.relevance
+    def _backtracking(gcntext: g.GCNText):
+        if "catastrophic" in gcntext:
+            re.search(r"(a+)+b", "a" * 40)
+        if "slow" in gcntext:
+            time.sleep(0.3)
+        return {}
+
+    stats_name = _backtracking.__module__ + '._backtracking'
+
+    try:
+        monkeypatch.setattr(c, 'workflow_budget_s', 0.2)
+
+        # interrupted in the main thread, as in process executor workers
+        c.workflow_stats.pop()
+        c_id, facts = c.workflows_for_input(gcn_entry(sample_gcn + "catastrophic\n"), output='list')
+        assert facts != []
+        assert c.workflow_stats.summary()[stats_name]['timeouts'] == 1
+        assert c.workflow_stats.summary()[stats_name]['timeout_docs'] == [c_id]
+
+        # only noticed when the call returns in other threads
+        with futures.ThreadPoolExecutor(1) as ex:
+            c_id, facts = ex.submit(c.workflows_for_input, gcn_entry(sample_gcn + "slow\n"), 'list').result()
+        assert facts != []
+        assert c.workflow_stats.summary()[stats_name]['timeout_docs'] == [c_id, c_id]
+
+        # workflows after the document budget is over are not run
+        monkeypatch.setattr(c, 'workflow_budget_s', None)
+        monkeypatch.setattr(c, 'document_budget_s', 0.1)
+        c.workflow_stats.pop()
+        with futures.ThreadPoolExecutor(1) as ex:
+            ex.submit(c.workflows_for_input, gcn_entry(sample_gcn + "slow\n"), 'list').result()
+        assert c.workflow_stats.summary()[stats_name]['timeouts'] == 1
+        assert 'facts.gcn.gcn_meta' not in c.workflow_stats.summary()
+    finally:
+        c.remove_workflow('_backtracking')
+
+    # learn does not accept a workflow budget it could not enforce
+    from click.testing import CliRunner
+    import facts.learn
+
+    r = CliRunner().invoke(facts.learn.cli, ["learn", "--gcn", "--workflow-budget-s", "1"])
+    assert r.exit_code == 2
+    assert "--executor process" in r.output
@@ -0,0 +1,56 @@
+def test_prefetch_in_order():
+    import time
+    from facts import fetch
+
+    def slow_square(i):
+        time.sleep(0.01 * (5 - i))
+        if i == 3:
+            raise ValueError(i)
+        return i * i
+
+    r = list(fetch.prefetch(slow_square, range(5), nthreads=3))
+
+    assert [item for item, _, _ in r] == list(range(5))
+    assert [result for _, result, e in r if e is None] == [0, 1, 4, 16]
+    assert isinstance(r[3][2], ValueError)
+
+
+def test_cached_get(tmp_path, monkeypatch):
+    import http.server
+    import threading
+    from facts import fetch
+
+    requests_seen = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+            else:
+                self.send_response(200)
+                self.send_header('ETag', '"v1"')
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(b'[{"a": 1}]')
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setenv("L2F_HTTP_CACHE", str(tmp_path / "http"))
+    monkeypatch.setenv("L2F_HTTP_STANDIN", f"https://example.org=http://127.0.0.1:{server.server_port}")
+
+    try:
+        url = "https://example.org/balrog/json"
+        assert fetch.cached_get(url, ttl_s=3600).json() == [{"a": 1}]
+        assert fetch.cached_get(url, ttl_s=3600).json() == [{"a": 1}]
+        assert requests_seen == [None]
+
+        assert fetch.cached_get(url, ttl_s=0).json() == [{"a": 1}]
+        assert requests_seen == [None, '"v1"']
+    finally:
+        server.shutdown()
@@ -1,5 +1,6 @@
 import pytest
 import logging
+import os
 
 from facts.arxiv import list_entries
 
@@ -25,7 +26,7 @@ def parse_atel(i):
     import facts.atel as a
     import facts.core as c
 
-    A = {int(v['atelid']):v for v in a.list_entries()}[i]
+    A = a.get_atel(i)
     F = c.workflows_for_input(dict(arg=A, arg_type=a.ATelEntry), output='dict')
     logger.info(F)
 
@@ -219,3 +220,101 @@ def test_gcn_tns():
 
     G = parse_gcn(31626)
     assert G['paper:mentions_named_event'] == ['AT2022cmc', 'GRB220211A', 'ZTF22aaajecb', 'ZTF22aaajecp']
+
+
+def test_subject_prefilters(monkeypatch):
+    import facts.core as c
+    import facts.gcn as g
+    import facts.bench
+
+    assert g.gcn_subject_lines("TITLE: x\nSubject: GRB 1: INTEGRAL\nDATE: y\n\nsubject: again") == \
+            ["Subject: GRB 1: INTEGRAL", "subject: again"]
+    assert g.subject_matches("integral") is g.subject_matches("integral")
+
+    docs = [dict(arg_type=g.GCNText, arg=t) for t in facts.bench.corpus_gcns(60)]
+    prefiltered = [c.workflows_for_input(d, output='list') for d in docs]
+
+    for w in c.workflows_by_type[g.GCNText]:
+        monkeypatch.setitem(w, 'prefilter', None)
+
+    assert [c.workflows_for_input(d, output='list') for d in docs] == prefiltered
+
+
+def test_gcn_archive(tmp_path, monkeypatch, sample_gcn):
+    import tarfile
+    import facts.gcn as g
+
+    monkeypatch.chdir(tmp_path)
+
+    (tmp_path / "gcn3").mkdir()
+    for i in 31373, 31374:
+        (tmp_path / "gcn3" / f"{i}.gcn3").write_text(sample_gcn.replace("31373", str(i)))
+
+    with tarfile.open("all_gcn_circulars.tar.gz", "w:gz") as tar:
+        tar.add("gcn3")
+
+    g.pack_gcn_tar("all_gcn_circulars.tar.gz")
+    g.gcn_archive.cache_clear()
+
+    (tmp_path / "gcn3" / "31373.gcn3").unlink()
+
+    try:
+        assert g.gcn_archive().ids() == [31373, 31374]
+        assert g.gcn_source(31373, allow_net=False) == sample_gcn
+        assert "NUMBER:  31374" in g.gcn_source(31374, allow_net=False)
+
+        # an archive in use keeps reading the circulars it had when it is replaced
+        archive = g.gcn_archive()
+        (tmp_path / "gcn3" / "31372.gcn3").write_text(sample_gcn.replace("31373", "31372"))
+        with tarfile.open("all_gcn_circulars.tar.gz", "w:gz") as tar:
+            tar.add("gcn3")
+        g.pack_gcn_tar("all_gcn_circulars.tar.gz")
+        g.reset_gcn_archive()
+
+        assert archive.read(31374).decode() == sample_gcn.replace("31373", "31374")
+        assert g.gcn_archive().ids() == [31372, 31374]
+        assert g.gcn_archive().read(31374) == (tmp_path / "gcn3" / "31374.gcn3").read_bytes()
+    finally:
+        g.reset_gcn_archive()
+
+    with g.GCNArchive(g.gcn_archive_fn) as archive:
+        assert 31372 in archive
+    assert archive.f.closed
+
+    # packs without the index inside, from older versions, are not read
+    (tmp_path / g.gcn_archive_fn).write_bytes(sample_gcn.encode())
+    try:
+        assert g.gcn_archive() is None
+    finally:
+        g.reset_gcn_archive()
+
+
+def test_gcn_fetch_missing(tmp_path, monkeypatch, sample_gcn):
+    import functools
+    import http.server
+    import threading
+    import facts.gcn as g
+
+    (tmp_path / "remote").mkdir()
+    (tmp_path / "remote" / "31373.gcn3").write_text(sample_gcn)
+    (tmp_path / "local").mkdir()
+    monkeypatch.chdir(tmp_path / "local")
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), 
+                functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(tmp_path / "remote")))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(g, 'gcn_url', lambda gcnid: f"http://127.0.0.1:{server.server_port}/{gcnid}.gcn3")
+
+    try:
+        handles = list(g.gcn_handles([31373, 31374]))
+    finally:
+        server.shutdown()
+
+    assert [h.key for h in handles] == [31373, 31374]
+    assert handles[0].load() == sample_gcn
+
+    # the circular which was not found is not asked for again, the server is gone
+    assert os.path.exists("gcn3/31374.missing")
+    with pytest.raises(g.NoSuchGCN):
+        handles[1].load()
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+import rdflib # type: ignore
+
+
+def test_publish_resumes(tmp_path, sample_gcn, gcn_entry):
+    import facts.core as c
+    import facts.kb
+
+    triples = []
+    for i in range(30):
+        triples += c.workflows_for_input(gcn_entry(sample_gcn.replace("31373", str(31373 + i))), output='triples')[1]
+
+    fn = str(tmp_path / "knowledge.n3")
+    open(fn, "w").write(c.serialize_graph(c.facts_graph(triples)))
+
+    prefixes = facts.kb.read_prefixes(fn)
+    published = rdflib.Graph()
+    n_inserts = [0]
+    fail_after = [2]
+
+    def insert(body):
+        n_inserts[0] += 1
+        if fail_after[0] is not None and n_inserts[0] > fail_after[0]:
+            raise RuntimeError("endpoint down")
+        published.parse(data="\n".join(prefixes) + "\n" + body, format="turtle")
+        return {}
+
+    with pytest.raises(RuntimeError):
+        facts.kb.publish_file(fn, insert=insert, max_in_flight=1, chunk_groups=3, target_chunk_s=1e-9, retry_backoff_s=0)
+
+    assert os.path.exists(fn + ".publish-checkpoint")
+    assert 0 < len(published) < len(rdflib.Graph().parse(fn, format="n3"))
+
+    fail_after[0] = None
+    n_inserts[0] = 0
+    facts.kb.publish_file(fn, insert=insert, max_in_flight=3, chunk_groups=3)
+
+    # only what was not checkpointed is sent again
+    assert n_inserts[0] < 30
+    assert set(published) == set(rdflib.Graph().parse(fn, format="n3"))
+    assert not os.path.exists(fn + ".publish-checkpoint")
+
+
+def test_publish_delta(tmp_path, sample_gcn, gcn_entry):
+    import facts.core as c
+    import facts.kb
+
+    def knowledge(gcnids):
+        triples = []
+        for i in gcnids:
+            triples += c.workflows_for_input(gcn_entry(sample_gcn.replace("31373", str(i))), output='triples')[1]
+        open(fn, "w").write(c.serialize_graph(c.facts_graph(triples)))
+
+    fn = str(tmp_path / "knowledge.n3")
+    published = rdflib.Graph()
+    sent = []
+
+    def update(operation):
+        def f(body):
+            sent.append((operation, body.count("\n") + 1))
+            for t in rdflib.Graph().parse(data=body, format="nt"):
+                getattr(published, operation)(t)
+            return {}
+        return f
+
+    knowledge(range(31373, 31383))
+    facts.kb.publish_delta(fn, insert=update('add'), delete=update('remove'))
+    assert set(published) == set(rdflib.Graph().parse(fn, format="n3"))
+    assert [o for o, n in sent] == ['add']
+
+    sent.clear()
+    knowledge(range(31375, 31385))
+    n_added, n_removed = facts.kb.publish_delta(fn, insert=update('add'), delete=update('remove'))
+
+    assert set(published) == set(rdflib.Graph().parse(fn, format="n3"))
+    assert sum(n for o, n in sent if o == 'add') == n_added
+    assert sum(n for o, n in sent if o == 'remove') == n_removed
+    assert 0 < n_added < len(published)
+
+    sent.clear()
+    assert facts.kb.publish_delta(fn, insert=update('add'), delete=update('remove')) == (0, 0)
+    assert sent == []
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+import rdflib # type: ignore
+
+
+@pytest.mark.parametrize("sort_output", [False, True])
+def test_learn_stream(tmp_path, sort_output, sample_gcn, gcn_inputs):
+    import typing
+    import facts.gcn as g
+    import facts.learn
+
+    output = str(tmp_path / "knowledge.n3")
+    sizes = []
+
+    def gcn_list_sample() -> typing.Generator[g.GCNText, None, None]:
+        for i in range(20):
+            sizes.append(os.path.getsize(output) if os.path.exists(output) else 0)
+            yield g.GCNText(sample_gcn.replace("31373", str(31373 + i)))
+
+    gcn_inputs(generator=gcn_list_sample)
+
+    facts.learn.learn_inputs(1, [g.GCNText], True, 'thread', None, output, None, sort_output)
+
+    G = rdflib.Graph()
+    G.parse(output, format='nt')
+    assert len(set(G.subjects())) == 20
+
+    if sort_output:
+        # written at once, when all facts are in
+        assert sizes[-1] == 0
+        assert os.path.exists(output + ".snapshot")
+    else:
+        assert sizes[-1] > 0
+
+
+def test_sharded_learn(tmp_path, gcn_inputs):
+    import time
+    import facts.core as c
+    import facts.gcn as g
+    import facts.learn
+    import facts.shards
+
+    gcn_inputs(12)
+
+    c.write_sorted_ntriples(c.stream_workflows_by_input(2, input_types=[g.GCNText]), str(tmp_path / "stream.nt"))
+
+    queue = facts.shards.ShardQueue(str(tmp_path / "shards.sqlite"), n_shards=4, lease_s=0.3)
+
+    with pytest.raises(Exception):
+        facts.shards.ShardQueue(str(tmp_path / "shards.sqlite"), n_shards=3)
+
+    # a worker which stopped, holding a shard
+    assert queue.lease("gone") == 0
+    time.sleep(0.4)
+
+    output = str(tmp_path / "knowledge.n3")
+    facts.learn.learn_shards(1, [g.GCNText], 'thread', queue, output)
+
+    assert queue.done()
+    assert len([fn for fn in queue.facts_fns() if os.path.getsize(fn) > 0]) > 1
+    assert open(output).read() == open(tmp_path / "stream.nt").read()
+
+
+def test_sharded_learn_fetches_once(monkeypatch, tmp_path, sample_gcn, gcn_inputs):
+    import typing
+    import facts.gcn as g
+    import facts.learn
+    import facts.shards
+
+    gcnids = list(range(31373, 31393))
+    generator_calls, fetched, loaded = [], [], []
+
+    def gcn_list_ids(shard=None) -> typing.Generator[g.GCNText, None, None]:
+        generator_calls.append(shard)
+        yield from g.gcn_handles(gcnids, shard)
+
+    def gcn_source(gcnid):
+        loaded.append(gcnid)
+        return g.GCNText(sample_gcn.replace("31373", str(gcnid)))
+
+    monkeypatch.setattr(g, 'gcn_fetch_missing', fetched.append)
+    monkeypatch.setattr(g, 'gcn_source', gcn_source)
+    gcn_inputs(generator=gcn_list_ids)
+
+    queue = facts.shards.ShardQueue(str(tmp_path / "shards.sqlite"), n_shards=4)
+    facts.learn.learn_shards(2, [g.GCNText], 'thread', queue, str(tmp_path / "knowledge.n3"))
+
+    # each circular is fetched and loaded once, by the shard it belongs to
+    assert len(generator_calls) == 4
+    assert sorted(fetched) == gcnids
+    assert sorted(loaded) == gcnids
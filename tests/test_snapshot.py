@@ -0,0 +1,36 @@
+import pytest
+import rdflib # type: ignore
+
+
+@pytest.mark.parametrize("fn", ["knowledge.n3", "knowledge.nt.gz"])
+def test_sorted_ntriples_and_snapshot(tmp_path, fn, sample_gcn, gcn_entry):
+    import facts.core as c
+    import facts.kb
+    from facts import snapshot
+
+    results = [c.workflows_for_input(gcn_entry(sample_gcn.replace("31373", str(i))), output='triples') for i in range(31373, 31393)]
+    # same facts again, they are written once
+    results += results[:5]
+
+    fn = str(tmp_path / fn)
+    n = c.write_sorted_ntriples(results, fn, run_rows=50)
+
+    with c.open_ntriples(fn) as f:
+        rows = f.readlines()
+
+    assert rows == sorted(set(rows))
+    assert n == len(rows)
+    assert not any(p.name.startswith(".nt-run-") for p in tmp_path.iterdir())
+
+    G = c.facts_graph([t for _, d in results for t in d])
+    assert set(rdflib.Graph().parse(data="".join(rows), format="nt")) == set(G)
+
+    s = snapshot.load(fn)
+    assert list(snapshot.ntriples_lines(s)) == rows
+    assert set(snapshot.triples(s)) == set(G)
+    assert facts.kb.ntriples_lines(fn) == set(rows)
+
+    # snapshot of an older version of the file is not used
+    with c.open_ntriples(fn, "at") as f:
+        f.write(rows[0])
+    assert snapshot.load(fn) is None
@@ -0,0 +1,19 @@
+def test_workflow_stats(tmp_path, gcn_entry):
+    import json
+    import facts.core as c
+
+    c.workflow_stats.pop()
+    c.workflows_for_input(gcn_entry(), output='triples')
+
+    summary = c.workflow_stats.summary()
+    assert summary['facts.gcn.mentions_keyword']['calls'] == 1
+    assert summary['facts.gcn.mentions_keyword']['facts'] > 0
+    assert summary['facts.gcn.swift_detected']['empty'] == 1
+    assert summary['facts.gcn.gcn_hawc']['skipped'] == 1
+    assert summary['facts.gcn.gcn_hawc']['calls'] == 0
+
+    c.workflow_stats.write_json(str(tmp_path / "stats.json"))
+    assert json.load(open(tmp_path / "stats.json")) == json.loads(json.dumps(summary))
+
+    c.workflow_stats.write_prometheus(str(tmp_path / "stats.prom"))
+    assert 'l2f_workflow_duration_seconds_count{workflow="facts.gcn.mentions_keyword"} 1' in open(tmp_path / "stats.prom").read()
@@ -0,0 +1,59 @@
+def test_daily_schedule(tmp_path):
+    import threading
+    import time
+    import facts.tools
+
+    log = []
+    lock = threading.Lock()
+    content = {'a': "1", 'b': "1"}
+    failing = {'b'}
+
+    def fetch(name):
+        def f():
+            with lock:
+                log.append(('start', name))
+            time.sleep(0.05)
+            if name in failing:
+                raise RuntimeError("unreachable")
+            fn = tmp_path / f"{name}.out"
+            if not fn.exists() or fn.read_text() != content[name]:
+                fn.write_text(content[name])
+            with lock:
+                log.append(('end', name))
+        return f
+
+    tasks = [
+        {'name': 'a', 'f': fetch('a'), 'period_s': 0, 'outputs': [str(tmp_path / "a.out")]},
+        {'name': 'b', 'f': fetch('b'), 'period_s': 0, 'outputs': [str(tmp_path / "b.out")]},
+        {'name': 'learn', 'f': lambda: log.append(('learn', None)), 'period_s': 3600, 'after': ['a', 'b']},
+    ]
+
+    def run():
+        log.clear()
+        facts.tools.schedule(tasks, one_shot=True, tick_s=0.01)
+        return ('learn', None) in log
+
+    # b fails and is backed off, without holding a and learn
+    assert run()
+    assert log.index(('start', 'b')) < log.index(('end', 'a')), "fetches should run concurrently"
+    assert log[-1] == ('learn', None)
+    assert tasks[1]['failures'] == 1 and tasks[1]['retry_at'] > time.time()
+    assert ('start', 'b') not in log[log.index(('start', 'b')) + 1:]
+
+    # b recovers and brings something new
+    failing.clear()
+    tasks[1]['retry_at'] = 0
+    assert run()
+    assert log[-1] == ('learn', None)
+    assert tasks[1]['failures'] == 0
+
+    # nothing new fetched, learn is skipped
+    assert not run()
+
+    content['a'] = "2"
+    assert run()
+
+    # fetches wait while learn, which reads their outputs, is running
+    tasks_by_name = {t['name']: t for t in tasks}
+    assert not facts.tools.task_ready(tasks[0], tasks_by_name, {'learn': None}, set(), time.time())
+    assert facts.tools.task_ready(tasks[0], tasks_by_name, {'b': None}, set(), time.time())
@@ -0,0 +1,92 @@
+import os
+
+import rdflib # type: ignore
+
+
+def test_reaction_views(tmp_path):
+    import facts.views
+
+    def doc(c_id, **facts):
+        return c_id, [(rdflib.URIRef(f"{facts_ns}#{c_id}"), rdflib.URIRef(f"{facts_ns}#{k}"), rdflib.Literal(v))
+                      for k, vs in facts.items() for v in (vs if isinstance(vs, list) else [vs])]
+
+    facts_ns = "http://odahub.io/ontology/paper"
+
+    docs = dict([
+        doc("gcn1", lvc_event_report="S200105ae", DATE="20/01/05 10:00:00 GMT"),
+        doc("gcn2", mentions_named_event="S200105ae", DATE="20/01/05 12:00:00 GMT", 
+                    original_event_utc="2020-01-05T09:00:00", instrument=["INTEGRAL", "SPI-ACS"]),
+        doc("gcn3", reports_icecube_event="IceCube-200106A", DATE="20/01/06 10:00:00 GMT",
+                    original_event_utc="2020-01-06T09:00:00", instrument="IceCube"),
+        doc("gcn4", mentions_named_event="IceCube-200106A", DATE="20/01/06 11:00:00 GMT",
+                    original_event_utc="2020-01-06T09:00:00", instrument="Swift"),
+        doc("gcn5", integral_grb_report="GRB 200107A", DATE="20/01/07 10:00:00 GMT", event_t0="2020-01-07T09:00:00"),
+    ])
+
+    def from_scratch(docs):
+        V = facts.views.ReactionViews(str(tmp_path / f"scratch-{len(docs)}.sqlite"))
+        V.update_documents(docs.items())
+        return V.counterpart_summary(), V.grb_summary()
+
+    V = facts.views.ReactionViews(str(tmp_path / "views.sqlite"))
+    for c_id, triples in docs.items():
+        V.update_document(c_id, triples)
+
+    counterparts = {s['event']: s for s in V.counterpart_summary()}
+    assert set(counterparts) == {"S200105ae", "IceCube-200106A"}
+    assert sorted(counterparts["S200105ae"]['instrument']) == ["INTEGRAL", "SPI-ACS"]
+    assert counterparts["IceCube-200106A"]['counterpart_gcn_time'] == "20/01/06 11:00:00 GMT"
+    assert V.grb_summary() == [dict(event="GRB 200107A", event_t0="2020-01-07T09:00:00", event_gcn_time="20/01/07 10:00:00 GMT")]
+
+    assert (V.counterpart_summary(), V.grb_summary()) == from_scratch(docs)
+
+    # a changed circular updates only its own event
+    docs.update([doc("gcn2", mentions_named_event="S200105ae", DATE="20/01/05 12:00:00 GMT", 
+                     original_event_utc="2020-01-05T09:00:00", instrument="INTEGRAL")])
+    assert V.update_document("gcn2", docs["gcn2"]) == 1
+    assert (V.counterpart_summary(), V.grb_summary()) == from_scratch(docs)
+
+    docs["gcn1"] = []
+    V.update_document("gcn1", [])
+    assert {s['event'] for s in V.counterpart_summary()} == {"IceCube-200106A"}
+    assert (V.counterpart_summary(), V.grb_summary()) == from_scratch(docs)
+
+    # feeding the same documents again, as the daily learn does, touches no events
+    assert V.update_documents(docs.items()) == 0
+
+    V.batch_size = 2
+    for c_id, triples in docs.items():
+        V.add_document(c_id, triples)
+    assert V.flush() == 0
+
+    docs.update([doc("gcn5", integral_grb_report="GRB 200107A", DATE="20/01/07 10:00:00 GMT", event_t0="2020-01-07T09:30:00")])
+    for c_id, triples in docs.items():
+        V.add_document(c_id, triples)
+    assert V.flush() == 1
+    assert (V.counterpart_summary(), V.grb_summary()) == from_scratch(docs)
+
+    # contemplate rebuilds views which do not match the knowledge file, e.g. made by learn without --views
+    import json
+    from click.testing import CliRunner
+    import facts.learn
+
+    knowledge = tmp_path / "knowledge.n3"
+
+    def write_knowledge(docs):
+        knowledge.write_text("".join(f"{s.n3()} {p.n3()} {o.n3()} .\n" for triples in docs.values() for s, p, o in triples))
+
+    def contemplate():
+        r = CliRunner().invoke(facts.learn.cli, ["contemplate", "--views", str(tmp_path / "views.sqlite"), "--knowledge", str(knowledge)])
+        assert r.exit_code == 0, r.output
+        return json.load(open("grb_gcn_reaction_summary.json"))
+
+    with CliRunner().isolated_filesystem(temp_dir=tmp_path):
+        write_knowledge(docs)
+        assert not V.source_matches(str(knowledge))
+        assert len(contemplate()) == 1
+        assert V.source_matches(str(knowledge))
+
+        del docs["gcn5"]
+        write_knowledge(docs)
+        os.utime(knowledge, ns=(0, 1))
+        assert contemplate() == []